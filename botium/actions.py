@@ -3,7 +3,7 @@ Contains bot's actions.
 
 author: Deniss Stepanovs
 """
-from .config import config
+from .config import config, current_config
 from .entities import Signal
 from .signals import Trigger, Response, NamedEntity, Matcher, Message, Event
 from .conditions import CountCondition, IntervalCondition
@@ -87,6 +87,7 @@ class Ask(Action):
         return Say(**kwargs) if kwargs else None
 
     def __call__(self, response=None, _area=None, **kwargs):
+        config = current_config()
         if response:
             if response.is_perfect:
                 # perfect match
@@ -149,6 +150,7 @@ class Ask(Action):
                     return [Say(text=config.MESSAGE_ASK_REPEAT), self]
 
     def to_store(self, response, text=None):
+        config = current_config()
         ct = current_time()
 
         rename = self.rename if self.rename is not None else {}
@@ -191,12 +193,13 @@ class Clarify(Action):
                       skip=bool)
 
     def to_say(self):
-        text = self.text if self.text else config.MESSAGE_CLARIFY % self.response.match
+        text = self.text if self.text else current_config().MESSAGE_CLARIFY % self.response.match
         options = list(self.options)
         return Say(text=text, options=options)
 
     @property
     def options(self):
+        config = current_config()
         if self.skip is None:
             return config.CONFIRM_SKIP_OPTIONS if config.CLARIFY_ALLOW_SKIP else config.CONFIRM_OPTIONS
         else:
@@ -204,6 +207,7 @@ class Clarify(Action):
 
     def __call__(self, response=None, _area=None, *args, **kwargs):
 
+        config = current_config()
         if response:
             if response.is_perfect:
                 if response.match == 'yes':
@@ -229,20 +233,25 @@ class Confirm(Action):
     This is a "syntactic sugar" for Ask.
     """
 
-    _structure = dict(may={'no'},
-                      must={'yes'},
-                      default=dict(text=config.MESSAGE_CONFIRM))
+    # no text - config.MESSAGE_CONFIRM of the bot saying it
+    _structure = dict(may={'no', 'text'},
+                      must={'yes'})
     _prototype = dict(text=str,
                       yes=[Signal],
                       no=[Signal])
 
-    options = config.CONFIRM_OPTIONS
+    @property
+    def options(self):
+        return current_config().CONFIRM_OPTIONS
 
     def to_say(self):
-        return Say(text=self.text, options=list(config.CONFIRM_OPTIONS.keys()))
+        config = current_config()
+        text = self.text if self.text is not None else config.MESSAGE_CONFIRM
+        return Say(text=text, options=list(config.CONFIRM_OPTIONS.keys()))
 
     def __call__(self, response=None, **kwargs):
 
+        config = current_config()
         if response:
             if response.match in config.CONFIRM_OPTIONS and response.is_perfect:
                 if response.match == 'yes':
@@ -376,7 +385,7 @@ class Graph(Action):
 
                 return actions
             else:
-                return [Say(text=config.MESSAGE_GRAPH_WRONG_TRANSITION), self]
+                return [Say(text=current_config().MESSAGE_GRAPH_WRONG_TRANSITION), self]
 
 
 class Attend(Action):
@@ -8,8 +8,14 @@ from .signals import *
 from .actions import *
 from .intents import Intent
 from .utils import *
-from . import config
+from .config import current_config
+from .conditions import ANY_TYPE, CountCondition
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import contextvars
 import logging
+import asyncio
+import time
 
 
 class Do(Area):
@@ -42,23 +48,29 @@ class Mouth(Area, StackState):
     Mouth listens to all objects that can be turned to Say.
     When Action arrives, it is transformed into Say object and pushed to the container.
     Keys of Say-objects are limited to {text, options, delay}
+    If a sink is attached (Bot(sink=...)), messages go to the sink (callable(dict)) instead of the container.
     """
     listen_to = [Ask, Say, Clarify, Confirm, Graph, Attend]
 
     _output_keys = {'text', 'options', 'delay'}
+    # callable(message dict), e.g. HttpSink.session(session_id)
+    _sink = None
 
     @staticmethod
     def text_delay(text):
         # in miliseconds
 
-        WPS = config.WPM / 60
+        WPS = current_config().WPM / 60
         n = len(text.split())
         return int(1000 * (0.3 + n / WPS))
 
     def append_and_log(self, action):
         if "Events" in self._areas:
             self._areas['Events'].log_signal(action)
-        self.append(action)
+        if self._sink is not None:
+            self._sink(dict(action))
+        else:
+            self.append(action)
 
     def pop_dicts(self):
         dicts = [dict(a) for a in self]
@@ -66,6 +78,7 @@ class Mouth(Area, StackState):
         return dicts
 
     def __call__(self, action):
+        config = current_config()
         if config.MODE == 'test':
             print("MOUTH:")
             print(action)
@@ -117,6 +130,48 @@ class Memory(Area, MemoryState):
                     logging.error('memory area: wrong type of signal output (should be dict or list of dicts)')
 
 
+def score_intent(cIntent, message, kwargs):
+    """scores an intent in a worker process (intent class and message are pickled)"""
+    return Matcher(options=cIntent(message=message).score)(message, **kwargs)
+
+
+class KeywordIndex:
+    """Inverted index: message words -> positions of intents that declared them as keywords"""
+
+    def __init__(self, intents):
+        # intents without keywords are always scored
+        self.always = set()
+        # first word -> [(position, phrase words), ...]
+        self.words = {}
+        # hash_text of intent's name -> positions (to find intents pushed by NLP)
+        self.names = {}
+
+        for position, cIntent in enumerate(intents):
+            self.names.setdefault(hash_text(cIntent._name), []).append(position)
+            if cIntent._keywords is None:
+                self.always.add(position)
+                continue
+            for keyword in list_of(cIntent._keywords):
+                phrase = tuple(TextFeatures(keyword).words)
+                if phrase:
+                    self.words.setdefault(phrase[0], []).append((position, phrase))
+
+    @classmethod
+    @lru_cache(maxsize=64)
+    def of(cls, intents):
+        """index is built once per tuple of intent classes (bots are often recreated per message)"""
+        return cls(intents)
+
+    def candidates(self, words):
+        """positions of intents whose keywords are in the words (+ always scored ones)"""
+        positions = set(self.always)
+        for i, word in enumerate(words):
+            for position, phrase in self.words.get(word, []):
+                if len(phrase) == 1 or tuple(words[i:i + len(phrase)]) == phrase:
+                    positions.add(position)
+        return positions
+
+
 class Attention(Area, MemoryState):
     """
     Attends and understands user input.
@@ -128,28 +183,34 @@ class Attention(Area, MemoryState):
 
     priority = 6
 
+    _nlp = None
+    _executor = None
+
     def __call__(self, signal, **kwargs):
         # received a message (directly from the sensors)
         if signal._is(Message):
-            # adding nlp stuff (not for serializing)
+            # adding nlp stuff (not for serializing): NLP runs only if its results are needed
             signal.attach_nlp(self._nlp)
 
             # areas monitor
             monitor = Monitor(self._areas)
 
-            # creating all things to attend to
+            # creating all things to attend to (intents are created only when scored)
             SOURCE_ATTENTION, SOURCE_INTENTS, SOURCE_COMMANDS = 'attention', 'intents', 'commands'
             attention = []
 
             # 1. intents
-            for cIntent in self._intents.values():
-                intent = cIntent(message=signal)
-                attention.append(dict(intent=intent,
-                                      options=intent.score,
-                                      source=SOURCE_INTENTS if not intent._command else SOURCE_COMMANDS))
+            intents = list(self._intents.values())
+            for position, scored in sorted(self.candidates(intents, signal, signal.nlp_intents()).items()):
+                cIntent = intents[position]
+                attention.append(dict(intent_class=cIntent,
+                                      position=position,
+                                      scored=scored,
+                                      source=SOURCE_INTENTS if not cIntent._command else SOURCE_COMMANDS))
             # 2. responses from Focus
             if self['focus']:
                 attention.append(dict(options=self['focus'].options,
+                                      position=len(intents),
                                       source=SOURCE_ATTENTION))
 
             if not attention:
@@ -163,25 +224,55 @@ class Attention(Area, MemoryState):
                 else:
                     a['weight'] = 1 if a['source'] in {SOURCE_INTENTS, SOURCE_COMMANDS} else 0
 
-            # intent classification
-            self.classify(attention, message=signal, **monitor)
-
-            # adding confidences from NLP part
-            if signal._intents is not None:
-                intent_confidence = {hash_text(d['intent']): d['confidence'] for d in signal._intents}
-                for att in attention:
-                    if att['source'] in {SOURCE_INTENTS, SOURCE_COMMANDS}:
-                        att['response']['confidence'] += intent_confidence.get(hash_text(att['intent']._name), 0)
-
-            # some base confidence to attention
-            for att in attention:
-                if att['source'] in {SOURCE_ATTENTION}:
-                    att['response']['confidence'] = min(1., att['response'].confidence + 0.1)
+            # intent classification: commands, focus, then intents
+            # an intent is skipped if even its upper bound can't beat the best so far (first one wins ties)
+            best = None
+            for source in [SOURCE_COMMANDS, SOURCE_ATTENTION, SOURCE_INTENTS]:
+                stage = [a for a in attention if a['source'] == source]
+                if source != SOURCE_ATTENTION:
+                    for a in stage:
+                        a['bound'] = self.upper_bound(a, message=signal, **monitor)
+                    stage.sort(key=lambda x: -x['bound'] if x['bound'] is not None else -float('inf'))
+
+                    if self._executor is not None:
+                        # scoring all at once, merging in the same order below
+                        self.classify_parallel([att for att in stage if att['weight'] and att['scored'] and
+                                                not self._is_beaten(att, best)], message=signal, **monitor)
+
+                for att in stage:
+                    if not att['weight']:
+                        # nothing to score: weighted confidence is zero anyway
+                        att['value'] = 0
+                    elif not att.get('scored', True):
+                        # no keywords in the message: only NLP confidence is left
+                        att['value'] = att['weight'] * self.nlp_confidence(att, signal)
+                    else:
+                        if self._is_beaten(att, best):
+                            continue
+
+                        if 'response' not in att:
+                            if source != SOURCE_ATTENTION:
+                                att['intent'] = att['intent_class'](message=signal)
+                                att['options'] = self._intent_options(att['intent'], signal)
+
+                            self.classify([att], message=signal, **monitor)
+
+                        if source == SOURCE_ATTENTION:
+                            # some base confidence to attention
+                            att['response']['confidence'] = min(1., att['response'].confidence + 0.1)
+                        else:
+                            # adding confidences from NLP part
+                            att['response']['confidence'] += self.nlp_confidence(att, signal)
+
+                        att['value'] = att['weight'] * att['response'].confidence
+
+                    if best is None or (att['value'], -att['position']) > (best['value'], -best['position']):
+                        best = att
 
             # selecting intents: confidence > 0 and > 0.7 of maximum confidence
             # max_score = max(attention, key=lambda x: x['weight'] * (x['response'].confidence))['response'].confidence
             # atts = [a for a in attention if 0 < a['response'].confidence > 0.7 * max_score]
-            atts = [max(attention, key=lambda x: x['weight'] * (x['response'].confidence))]
+            atts = [best]
 
             signals = []
             for att in atts:
@@ -190,7 +281,7 @@ class Attention(Area, MemoryState):
                     actions = self._process_signal(focus, response=att['response'])
                     self._areas['Actions'].push(actions)
                 else:
-                    signals.append(att['intent'])
+                    signals.append(att['intent'] if 'intent' in att else att['intent_class'](message=signal))
 
             return signals
 
@@ -200,11 +291,140 @@ class Attention(Area, MemoryState):
                 signal['_n'] = signal.get('_n', 0) + 1
                 self['focus'] = signal
 
+    async def acall(self, signal, **kwargs):
+        if signal._is(Message):
+            # awaiting NLP (not lazy here: it can't be awaited on demand) and async intents first, the rest is the same
+            signal.attach_nlp(self._nlp)
+            await signal.arun_nlp()
+            await self.ascore(signal)
+        return self(signal, **kwargs)
+
+    async def ascore(self, message):
+        """
+        Awaits scores of async intents (concurrently, at most config.SCORE_TIMEOUT seconds each),
+        they are taken from the message when the intents are classified.
+        """
+        intents = list(self._intents.values())
+        intents = [intents[position] for position, scored in
+                   sorted(self.candidates(intents, message, message.nlp_intents()).items())
+                   if scored and asyncio.iscoroutinefunction(intents[position].score)]
+        if self['focus']:
+            # only commands are weighed
+            intents = [cIntent for cIntent in intents if cIntent._command]
+        if not intents:
+            return
+
+        monitor = Monitor(self._areas)
+
+        async def score(cIntent):
+            try:
+                return await asyncio.wait_for(cIntent(message=message).score(message, **monitor), current_config().SCORE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.warning('intent <%s> timed out' % cIntent._name)
+                return 0
+
+        scores = await asyncio.gather(*[score(cIntent) for cIntent in intents])
+        message._async_scores = {cIntent._name: s for cIntent, s in zip(intents, scores)}
+
+    @staticmethod
+    def _intent_options(intent, message):
+        """intent's score method, or its result if it was awaited already (see .ascore)"""
+        if message._async_scores is not None and intent._name in message._async_scores:
+            score = message._async_scores[intent._name]
+            return lambda message, **kwargs: score
+        return intent.score
+
+    def candidates(self, intents, message, nlp_intents):
+        """
+        Positions of intents to attend to -> whether the intent has to be scored.
+
+        Intents with keywords are scored only if the keywords are in the message, otherwise their score is 0.
+        Such intents are still taken if NLP gives them confidence, and the first of them is kept
+        as it wins when nothing scores.
+        """
+        if message.text is None:
+            return {position: True for position in range(len(intents))}
+
+        index = KeywordIndex.of(tuple(intents))
+        candidates = {position: True for position in index.candidates(message.features.words)}
+
+        for name in nlp_intents:
+            for position in index.names.get(name, []):
+                candidates.setdefault(position, False)
+
+        first = next((p for p in range(len(intents)) if p not in candidates), None)
+        if first is not None:
+            candidates[first] = False
+
+        return candidates
+
+    def upper_bound(self, att, message, **kwargs):
+        """upper bound of the weighted confidence of an intent (None - unknown)"""
+        if message.text is None:
+            return None
+        if not att['weight']:
+            return 0
+        if not att.get('scored', True):
+            return att['weight'] * self.nlp_confidence(att, message)
+        bound = att['intent_class'].upper_bound(message, **kwargs)
+        if bound is None:
+            return None
+        return att['weight'] * (bound + self.nlp_confidence(att, message))
+
+    @staticmethod
+    def nlp_confidence(att, message):
+        """NLP confidence of the intent, NLP runs on the first need"""
+        if 'nlp_confidence' not in att:
+            att['nlp_confidence'] = message.intent_confidence(att['intent_class']._name)
+        return att['nlp_confidence']
+
+    @staticmethod
+    def _is_beaten(att, best):
+        """intent's upper bound can't beat the best so far (first one wins ties)"""
+        return best is not None and att.get('bound') is not None and \
+               (att['bound'], -att['position']) < (best['value'], -best['position'])
+
     def classify(self, attention, message, **kwargs):
         """just gets a match to everything in attention"""
         for att in attention:
             att['response'] = Matcher(options=att['options'])(message, _areas=self._areas, **kwargs)
 
+    def classify_parallel(self, attention, message, **kwargs):
+        """
+        Scores intents with the executor, waiting at most config.SCORE_TIMEOUT seconds.
+
+        Late intents score 0. Process pools get no areas: intents must be picklable and not use _areas,
+        NLP runs before (messages are sent with the results, not with the engine).
+        """
+        config = current_config()
+        if isinstance(self._executor, ProcessPoolExecutor) and attention:
+            # the engine stays here, its results go to the processes
+            message._run_nlp()
+
+        futures = []
+        for att in attention:
+            att['intent'] = att['intent_class'](message=message)
+            att['options'] = self._intent_options(att['intent'], message)
+            if isinstance(self._executor, ProcessPoolExecutor):
+                future = self._executor.submit(score_intent, att['intent_class'], message, kwargs)
+            else:
+                # bot's config goes to the thread too
+                future = self._executor.submit(contextvars.copy_context().run, Matcher(options=att['options']),
+                                               message, _areas=self._areas, **kwargs)
+            futures.append(future)
+
+        deadline = time.time() + config.SCORE_TIMEOUT if config.SCORE_TIMEOUT is not None else None
+        for att, future in zip(attention, futures):
+            try:
+                response = future.result(timeout=max(0, deadline - time.time()) if deadline is not None else None)
+                # process pools send back a copy of the message
+                response['message'] = message
+            except TimeoutError:
+                future.cancel()
+                logging.warning('intent <%s> timed out' % att['intent']._name)
+                response = Response(message=message, confidence=0, match=None)
+            att['response'] = response
+
 
 class Actions(Area, StackState):
     """
@@ -261,8 +481,8 @@ class Triggers(Area, StackState):
     def __call__(self, signal):
 
         if signal._is(Event):
-            # updating/triggering all triggers
-            for trigger in self:
+            # updating/triggering the triggers that depend on the event
+            for trigger in self.relevant(signal):
                 self._process_signal(trigger, event=signal)
             # if it is ready and should be run "before" (usually not)
             return self.pop_triggered(instant=True)
@@ -273,10 +493,55 @@ class Triggers(Area, StackState):
             if triggers:
                 self.append(triggers)
 
+    def _update_index(self):
+        # rebuilt if the triggers were changed (indexed triggers are kept, so ids are not reused)
+        indexed = getattr(self, '_indexed', None)
+        if indexed is not None and len(indexed) == len(self) and all(a is b for a, b in zip(indexed, self)):
+            return
+
+        self._indexed = list(self)
+        # (signal name, event type) -> positions of triggers, positions of triggers depending on any event
+        self._index = {}
+        self._any_event = []
+        # positions of triggers with count conditions (relevant when a condition is met)
+        self._counted = []
+
+        if self._areas and Events._name in self._areas:
+            counts = []
+            for i, trigger in enumerate(self):
+                conditions = [c for c in list_of(trigger.condition) if c._is(CountCondition)]
+                if conditions:
+                    counts += conditions
+                    self._counted.append((i, conditions))
+            self._areas[Events._name].watch(counts)
+
+        for i, trigger in enumerate(self):
+            keys = trigger.depends_on()
+            if keys is None:
+                self._any_event.append(i)
+            else:
+                for key in set(keys):
+                    self._index.setdefault(key, []).append(i)
+
+    def relevant(self, event):
+        """triggers that can be triggered by the event (in the order they are kept)"""
+        self._update_index()
+        positions = set(self._any_event)
+        positions.update(i for i, conditions in self._counted if any(c._met for c in conditions))
+        for name in relative_names(event.signal.__class__):
+            positions.update(self._index.get((name, event.type), ()))
+            positions.update(self._index.get((name, ANY_TYPE), ()))
+        return [self[i] for i in sorted(positions)]
+
     def check(self):
         for trigger in self:
             self._process_signal(trigger, event=Event(signal=Check()))
 
+    def due_time(self):
+        """the earliest time (ms) a trigger is due (see Trigger.due_time), None if there is no such"""
+        times = [t for t in (trigger.due_time() for trigger in self) if t is not None]
+        return min(times) if times else None
+
     def pop_triggered(self, instant=False):
         triggered = []
         keep = []
@@ -308,12 +573,31 @@ class Events(Area, MemoryState):
     # should run first
     priority = 10
 
+    # counter key -> count conditions (see .watch)
+    _watchers = None
+
+    def watch(self, conditions):
+        """
+        Sets count conditions to watch (replacing the old ones): condition._met is set once,
+        then the counter increments mark the condition met when its threshold is reached.
+        """
+        self._watchers = {}
+        for condition in conditions:
+            self._watchers.setdefault(condition.count_key(), []).append(condition)
+            condition._met = condition.n <= self.get(condition.count_key(), 0)
+
+    def clear(self):
+        MemoryState.clear(self)
+        if self._watchers:
+            # counters are gone
+            self.watch([condition for conditions in self._watchers.values() for condition in conditions])
+
     def log_signal(self, signal):
         record = dict(signal=signal,
                       signal_name=signal._name,
                       signal_type=signal._type,
                       time=current_time())
-        self['log'] = (self.get('log', []) + [record])[-config.LOG_LIMIT:]
+        self['log'] = (self.get('log', []) + [record])[-current_config().LOG_LIMIT:]
 
     @property
     def log(self):
@@ -338,7 +622,12 @@ class Events(Area, MemoryState):
             key = "counts.%s.%s.%s" % (signal._type, signal._name, event_type)
 
         # saving precise counts
-        self[key] = self.get(key, 0) + 1
+        count = self.get(key, 0) + 1
+        self[key] = count
+        if self._watchers and key in self._watchers:
+            for condition in self._watchers[key]:
+                if not condition._met and condition.n <= count:
+                    condition._met = True
 
         # saving summaries
         subs = key.split('.')
@@ -353,6 +642,6 @@ class Events(Area, MemoryState):
         record = dict(signal_name=signal._name,
                       signal_type=signal._type,
                       time=current_time())
-        self['history'] = (self.get('history', []) + [record])[-config.HISTORY_LIMIT:]
+        self['history'] = (self.get('history', []) + [record])[-current_config().HISTORY_LIMIT:]
 
         return event_out
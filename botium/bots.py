@@ -7,9 +7,10 @@ from .config import config
 from .entities import Entity
 from .areas import Do, Events, Attention, Memory, Actions, Triggers, Mouth
 from .signals import Message
-from .intents import Echo, FirstMessage, Stop, Restart
-from .utils import list_of, from_camel
+from .intents import Intent, Echo, FirstMessage, Stop, Restart
+from .utils import list_of, from_camel, run_sync
 
+import asyncio
 import logging
 from collections import OrderedDict
 from itertools import groupby
@@ -39,15 +40,17 @@ class Bot:
         Mouth,
     ]
 
-    def __init__(self, state=None, intents=None, nlp=None, **kwargs):
+    def __init__(self, state=None, intents=None, nlp=None, executor=None, sink=None, **kwargs):
         # bot mode
         self.nlp = nlp
+        # concurrent.futures executor for scoring intents in parallel (None - one by one)
+        self.executor = executor
+        # where Mouth sends messages (None - they are kept in Mouth, see Mouth.pop_dicts)
+        self.sink = sink
 
-        if kwargs:
-            config.update(kwargs)
-
-        if self._config is not None:
-            config.update(self._config)
+        # bot's own config (immutable): the global one with overrides of the class (_config) and kwargs
+        overrides = dict(self._config or {}, **kwargs)
+        self.config = config.frozen(overrides) if overrides else config
 
         # for Intents area
         self._intents = {intent._name: intent for intent in self._intents_ + self.intents + list_of(intents)}
@@ -67,6 +70,9 @@ class Bot:
             if cArea in {Attention}:
                 area._intents = self._intents
                 area._nlp = self.nlp
+                area._executor = self.executor
+            if cArea in {Mouth}:
+                area._sink = sink
 
             self._areas[area_name] = area
 
@@ -81,18 +87,78 @@ class Bot:
     def reply(self, **kwargs):
 
         if kwargs:
-            message = Message(**kwargs)
+            self._reply(self._message(kwargs))
+
+        else:
+            logging.warning("reply: nothing is provided to create a Message from")
+
+    def _reply(self, message):
+        with self.config.active():
             if Events._name in self._areas:
                 # logging the message
                 self._areas[Events._name].log_signal(message)
 
             self.process(None, message)
 
+    def _message(self, kwargs):
+        # the message is created (validated) with the bot's config
+        with self.config.active():
+            return Message(**kwargs)
+
+    async def areply(self, **kwargs):
+        """
+        Async version of .reply: async areas, intents and NLP are awaited (not blocking the event loop).
+
+        Examples
+        --------
+        >>> await bot.areply(text='hi')
+        """
+        if kwargs:
+            await self._areply(self._message(kwargs))
+
         else:
             logging.warning("reply: nothing is provided to create a Message from")
 
+    async def _areply(self, message):
+        with self.config.active():
+            if Events._name in self._areas:
+                # logging the message
+                self._areas[Events._name].log_signal(message)
+
+            await self.aprocess(None, message)
+
+    @staticmethod
+    def reply_batch(pending):
+        """
+        Replies to several messages, NLP runs once (as a batch) for all messages of bots sharing the engine.
+
+        :param pending: list of (bot, kwargs) pairs, kwargs are the same as for .reply(**kwargs)
+
+        Examples
+        --------
+        >>> Bot.reply_batch([(bot1, dict(text='hi')), (bot2, dict(text='hello'))])
+        """
+        pending = [(bot, bot._message(kwargs)) for bot, kwargs in pending if kwargs]
+
+        # grouping messages by NLP engine
+        engines = OrderedDict()
+        for bot, message in pending:
+            if bot.nlp:
+                engines.setdefault(id(bot.nlp), (bot.nlp, []))[1].append(message)
+
+        for nlp, messages in engines.values():
+            for message, result in zip(messages, nlp.batch([message.text for message in messages])):
+                message.set_nlp(result)
+
+        for bot, message in pending:
+            bot._reply(message)
+
     def _get_sensor_interface(self, name):
-        return lambda **kwargs: self.process(self._areas[name], self._areas[name](**kwargs))
+        def sense(**kwargs):
+            with self.config.active():
+                self.process(self._areas[name], self._areas[name](**kwargs))
+
+        return sense
 
     def _process(self, source_area, signals_in):
         """Recursive part of the progress"""
@@ -102,25 +168,67 @@ class Bot:
                 for signal_in in list_of(signals_in):
                     if signal_in is not None:
                         if any([signal_in._is_relative_to(a) for a in area.listen_to]):
-                            signal_out = area(signal_in)
+                            signal_out = run_sync(area(signal_in))
                             if signal_out:
                                 self._process(area, signal_out)
 
+    async def _aprocess(self, source_area, signals_in):
+        """Recursive part of the progress (async)"""
+        signals_in = list_of(signals_in)
+        await self._await_intents(signals_in)
+
+        for area in self._areas.values():
+            # sensors and source areas (those who made a signal) don't receive a signal
+            if (area != source_area or area.listen_to_self) and not area.is_interface:
+                for signal_in in signals_in:
+                    if any([signal_in._is_relative_to(a) for a in area.listen_to]):
+                        signal_out = await area.acall(signal_in)
+                        if signal_out:
+                            await self._aprocess(area, signal_out)
+
+    async def _await_intents(self, signals):
+        """awaits actions of async intents, Actions area takes them as if intents were sync"""
+        if Actions._name not in self._areas:
+            return
+
+        for signal in signals:
+            if signal._is_relative_to(Intent) and asyncio.iscoroutinefunction(signal.__call__) and \
+                    signal._awaited_result is None:
+                signal._awaited_result = list_of(await signal(_area=self._areas[Actions._name], _areas=self._areas))
+
     def process(self, source_area, signal_in):
         """
         Progresses (propagates) the signal from source_area
         :param source_area: area that generated the signal
         :param signal_in:  the signal that was generated
         """
-        # progressing the signal (entering recursion)
-        self._process(source_area, signal_in)
+        with self.config.active():
+            # progressing the signal (entering recursion)
+            self._process(source_area, signal_in)
+
+            # Some things still needed to be checked: Triggers and pending actions
+
+            # Triggering "after" type of triggers
+            self._check_triggers()
+
+            # Checking for pending action if Attention is empty
+            pending = self._pending_action()
+            if pending:
+                # progressing further
+                self.process(*pending)
 
-        # Some things still needed to be checked: Triggers and pending actions
+    async def aprocess(self, source_area, signal_in):
+        """Async version of .process"""
+        with self.config.active():
+            await self._aprocess(source_area, signal_in)
+            await self._acheck_triggers()
 
-        # Triggering "after" type of triggers
-        self._check_triggers()
+            pending = self._pending_action()
+            if pending:
+                await self.aprocess(*pending)
 
-        # Checking for pending action if Attention is empty
+    def _pending_action(self):
+        """(Actions area, pending action) if the bot is free to act, otherwise None"""
         if Actions._name in self._areas:
             # checking if current action is not expection
             is_exception = bool(
@@ -132,27 +240,53 @@ class Bot:
                 # getting pending task from Actions
                 signal_in = source_area()
                 if signal_in:
-                    # progressing further
-                    self.process(source_area, signal_in)
+                    return source_area, signal_in
 
-    def _check_triggers(self):
-        """
-        Checks and processes bot's triggers
-
-        It is mainly needed to check the conditions that involve time as bot cannot get himself awaken.
-        """
+    def _pop_triggered(self):
+        """(Triggers area, triggers that are ready) or None"""
         if Triggers._name in self._areas:
             # if bot has triggers at all
             trigger_area = self._areas[Triggers._name]
             # getting already triggered stuff (that needed to be run "after" - standard mode)
             triggers = trigger_area.pop_triggered(instant=False)
             if triggers:
-                self.process(trigger_area, triggers)
+                return trigger_area, triggers
+
+    def _check_triggers(self):
+        """
+        Checks and processes bot's triggers
+
+        It is mainly needed to check the conditions that involve time as bot cannot get himself awaken.
+        """
+        triggered = self._pop_triggered()
+        if triggered:
+            self.process(*triggered)
+
+    async def _acheck_triggers(self):
+        triggered = self._pop_triggered()
+        if triggered:
+            await self.aprocess(*triggered)
 
     def check(self):
         if Triggers._name in self._areas:
-            self._areas[Triggers._name].check()
-            self._check_triggers()
+            with self.config.active():
+                self._areas[Triggers._name].check()
+                self._check_triggers()
+
+    async def acheck(self):
+        """Async version of .check"""
+        if Triggers._name in self._areas:
+            with self.config.active():
+                self._areas[Triggers._name].check()
+                await self._acheck_triggers()
+
+    def due_time(self):
+        """
+        Time (ms) when .check should be called next (time triggers), None if there are no time triggers.
+        See botium.scheduler.Scheduler.
+        """
+        if Triggers._name in self._areas:
+            return self._areas[Triggers._name].due_time()
 
     def log(self, grouped=False):
         # self = bot
@@ -183,6 +317,7 @@ class Bot:
 
         # creating test bot for validation (so current bot's states are not altered)
         bot = self.__class__(self.state)
+        bot.config = self.config
 
         stateful_areas = [area for area in bot._areas.values() if area._name not in {'Events'} and area.is_stateful]
         # areas in which the effect of a messages could have been notices (except motors)
@@ -10,6 +10,9 @@ from .utils import current_time
 
 import re
 
+# any type of event (see Condition.depends_on)
+ANY_TYPE = '*'
+
 
 class Condition(Signal):
     """Prototype for creating Conditions
@@ -19,9 +22,26 @@ class Condition(Signal):
     _structure = dict(must={'event'})
     _prototype = dict(event='@Event')
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # dependencies belong to the __call__ of the class declaring them: new __call__, checked on every event
+        if '__call__' in cls.__dict__ and 'depends_on' not in cls.__dict__:
+            cls.depends_on = Condition.__dict__['depends_on']
+
     def reset(self):
         pass
 
+    def due_time(self):
+        """time (ms) when the condition will be met by itself, None if it depends on events"""
+        return None
+
+    def depends_on(self):
+        """
+        (signal name, event type) of the events that can meet the condition, ANY_TYPE matches any event type.
+        None - not known, the condition is checked on every event (see Triggers area).
+        """
+        return None
+
     def __call__(self, *args, **kwargs):
         """Must return bool: True if condition is met, False otherwise."""
         assert False
@@ -36,12 +56,16 @@ class TextCondition(Condition):
 
     def __call__(self, event, _areas=None, **kwargs):
         if event.signal._is_relative_to(self.event.signal) and event.signal.text:
-            message = Message(text=event.signal.text)
+            # messages are reused: text features are computed once for all conditions
+            message = event.signal if event.signal._is(Message) else Message(text=event.signal.text)
             response = Matcher(options=self.options)(message)
             return response.is_perfect
         else:
             return False
 
+    def depends_on(self):
+        return [(self.event.signal._name, ANY_TYPE)]
+
 
 class EventCondition(Condition):
     """Condition on occurrence of an event"""
@@ -57,6 +81,9 @@ class EventCondition(Condition):
             # complete match of the events
             return self.event == event
 
+    def depends_on(self):
+        return [(self.event.signal._name, self.event.type)]
+
 
 class CountCondition(Condition):
     """Condition on counts of events"""
@@ -66,10 +93,21 @@ class CountCondition(Condition):
                       may={'type'})
     _prototype = dict(event='@Event', n=int)
 
+    def count_key(self):
+        """key of the counter in Events area"""
+        if self._count_key is None:
+            event_type = self.event.type if self.event.type else 'n'
+            self._count_key = "counts.%s.%s.%s" % (self.event.signal._type, self.event.signal._name, event_type)
+        return self._count_key
+
+    def depends_on(self):
+        # watched conditions are marked met by Events area (see Events.watch), unwatched are checked on every event
+        return [] if self._met is not None else None
+
     def __call__(self, event, _areas=None, **kwargs):
-        event_type = self.event.type if self.event.type else 'n'
-        key = "counts.%s.%s.%s" % (self.event.signal._type, self.event.signal._name, event_type)
-        return self.n <= _areas['Events'].get(key, 0)
+        if self._met is not None:
+            return self._met
+        return self.n <= _areas['Events'].get(self.count_key(), 0)
 
 
 class TimeCondition(Condition):
@@ -81,6 +119,9 @@ class TimeCondition(Condition):
     _structure = dict(must={'time'})
     _prototype = dict(time=int)
 
+    def due_time(self):
+        return self.time
+
     def __call__(self, event, _areas=None, **kwargs):
         return current_time() >= self.time
 
@@ -100,6 +141,9 @@ class IntervalCondition(Condition):
         """updating condition, needed for repeating the condition (n>1)"""
         self['time'] = current_time()
 
+    def due_time(self):
+        return self.time + self.interval if self.time is not None else None
+
     def __call__(self, event, _areas=None, **kwargs):
         check = current_time() >= self.time + self.interval
         if check:
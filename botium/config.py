@@ -3,7 +3,10 @@ Bot's configuration file.
 
 author: Deniss Stepanovs
 """
+from contextlib import contextmanager
+from contextvars import ContextVar
 import logging
+import copy
 
 
 class Config:
@@ -82,6 +85,13 @@ class Config:
     # TODO: add test
     MATCH_LOWER_CASE = True
 
+    # how many Matcher results (deterministic options only) to keep, 0 - no caching
+    # (the cache is shared by all bots: its size is set globally, a bot's own 0 turns caching off for the bot)
+    MATCH_CACHE_SIZE = 4096
+
+    # seconds intents may take when scored by Bot(executor=...), late intents score 0 (None - wait for all)
+    SCORE_TIMEOUT = None
+
     # history limit (how much to story in progress.history)
     HISTORY_LIMIT = 64
     # log (user:messages and bot:says)
@@ -109,5 +119,54 @@ class Config:
 
         self._update(params)
 
+    def frozen(self, config=None, **kwargs):
+        """immutable copy of the config with given keys overridden, e.g. config of a bot"""
+        params = dict(**kwargs)
+        if type(config) == dict:
+            params.update(config)
+
+        return FrozenConfig(self, params)
+
+    @contextmanager
+    def active(self):
+        """makes the config current for the code running in this thread (or asyncio task)"""
+        token = _active_config.set(self)
+        try:
+            yield self
+        finally:
+            _active_config.reset(token)
+
+
+class FrozenConfig(Config):
+    """
+    Immutable config: all values are taken (copied) from the base config once, then overridden.
+
+    Changes of the base config are not seen, changes of the frozen config are not allowed.
+    """
+
+    def __init__(self, base, overrides=None):
+        values = {k: copy.deepcopy(getattr(base, k)) for k in dir(Config) if k.isupper()}
+        for k, v in (overrides or {}).items():
+            if k in values:
+                values[k] = v
+            else:
+                logging.error("unknown config key (%s)" % k)
+        self.__dict__.update(values)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("config is frozen, override it when creating the bot: Bot(%s=...)" % key)
+
+    def _update(self, config_dict):
+        raise AttributeError("config is frozen, override it when creating the bot: Bot(**config)")
+
 
 config = Config()
+
+# config of the bot that is running (None - global config)
+_active_config = ContextVar('botium_config', default=None)
+
+
+def current_config():
+    """config of the bot running in this thread (or asyncio task), the global config otherwise"""
+    active = _active_config.get()
+    return config if active is None else active
@@ -0,0 +1,147 @@
+"""
+Contains Dispatcher: runs bots of many users in parallel, messages of the same user one by one.
+"""
+from concurrent.futures import Future
+from collections import deque
+import threading
+import queue
+import logging
+
+
+class Dispatcher:
+    """
+    Fixed pool of worker threads with a FIFO queue per session (user).
+
+    Tasks of the same session run one at a time, in the order they were submitted, tasks of different sessions
+    run in parallel. Sessions take turns: a worker runs one task of a session, then moves to the next session.
+
+    :param workers: number of worker threads
+    :param max_pending: max number of tasks waiting in all queues (None - unlimited), .submit waits or fails if full
+    :param max_session_pending: max number of tasks waiting in one session's queue (None - unlimited)
+
+    Examples
+    --------
+    >>> dispatcher = Dispatcher(workers=8, max_pending=1000)
+    >>> dispatcher.submit(user_id, reply, user_id, text)
+    """
+
+    def __init__(self, workers=4, max_pending=None, max_session_pending=None):
+        self.max_pending = max_pending
+        self.max_session_pending = max_session_pending
+
+        # session -> deque of (future, fn, args, kwargs), only sessions with waiting tasks
+        self._queues = {}
+        # sessions with waiting tasks and no task running
+        self._ready = deque()
+        self._running = set()
+        self._pending = 0
+        self._counts = dict(submitted=0, processed=0, failed=0, rejected=0)
+        self._closed = False
+        self._lock = threading.Condition()
+
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, session_id, fn, *args, block=True, timeout=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs) for the session.
+
+        :param block: wait for a free place if queues are full (otherwise queue.Full is raised)
+        :param timeout: seconds to wait for a free place (None - forever), then queue.Full is raised
+        :return: concurrent.futures.Future of the result
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('dispatcher is closed')
+
+            if not self._lock.wait_for(lambda: self._has_place(session_id), timeout if block else 0):
+                self._counts['rejected'] += 1
+                raise queue.Full('dispatcher queue is full (session %s)' % session_id)
+
+            if session_id not in self._queues:
+                self._queues[session_id] = deque()
+                if session_id not in self._running:
+                    self._ready.append(session_id)
+            self._queues[session_id].append((future, fn, args, kwargs))
+            self._pending += 1
+            self._counts['submitted'] += 1
+            self._lock.notify_all()
+
+        return future
+
+    def _has_place(self, session_id):
+        if self.max_pending is not None and self._pending >= self.max_pending:
+            return False
+        if self.max_session_pending is not None and len(self._queues.get(session_id, ())) >= self.max_session_pending:
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._ready or self._closed)
+                if not self._ready:
+                    # closed and nothing left
+                    return
+
+                session_id = self._ready.popleft()
+                session_queue = self._queues[session_id]
+                future, fn, args, kwargs = session_queue.popleft()
+                if not session_queue:
+                    del self._queues[session_id]
+                self._running.add(session_id)
+                self._pending -= 1
+                # there is a free place now
+                self._lock.notify_all()
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                    failed = False
+                except Exception as e:
+                    logging.error('dispatcher: task of session %s failed (%r)' % (session_id, e))
+                    future.set_exception(e)
+                    failed = True
+            else:
+                failed = None
+
+            with self._lock:
+                self._running.discard(session_id)
+                if session_id in self._queues:
+                    # next task of the session waits for its turn
+                    self._ready.append(session_id)
+                if failed is not None:
+                    self._counts['failed' if failed else 'processed'] += 1
+                self._lock.notify_all()
+
+    def stats(self):
+        """queue depths and counts of tasks"""
+        with self._lock:
+            depths = [len(q) for q in self._queues.values()]
+            return dict(pending=self._pending,
+                        running=len(self._running),
+                        sessions=len(self._queues),
+                        max_session_depth=max(depths) if depths else 0,
+                        **self._counts)
+
+    def join(self, timeout=None):
+        """waits until all submitted tasks are done, False on timeout"""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending and not self._running, timeout)
+
+    def close(self, wait=True):
+        """stops accepting tasks, workers finish the queued ones and stop"""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -3,7 +3,7 @@ Contains bot's top level entities.
 
 author: Deniss Stepanovs
 """
-from .config import config
+from .config import current_config
 from .utils import *
 import logging
 
@@ -284,7 +284,7 @@ class Signal(Entity, dict):
             setattr(self, k, v)
 
         # validating structure
-        if config.MODE == 'test':
+        if current_config().MODE == 'test':
             self._validate()
 
     def __call__(self, *args, **kwargs):
@@ -303,6 +303,9 @@ class Signal(Entity, dict):
 
     def __getattr__(self, item):
         # is called when "get" didn't find anything
+        if item.startswith('__') and item.endswith('__'):
+            # special methods are looked up by copy/pickle protocols
+            raise AttributeError(item)
         return None
 
     def __setitem__(self, key, value):
@@ -439,4 +442,16 @@ class Area(Entity):
         return self._jsonify({self.__class__.__name__: self._state})
 
     def _process_signal(self, signal_in, **kwargs):
-        return list_of(signal_in(_area=self, _areas=self._areas, **kwargs)) if signal_in is not None else []
+        if signal_in is None:
+            return []
+
+        if signal_in._awaited_result is not None:
+            # async signal, already awaited by the async Bot API (Bot.areply)
+            result, signal_in._awaited_result = signal_in._awaited_result, None
+            return result
+
+        return list_of(run_sync(signal_in(_area=self, _areas=self._areas, **kwargs)))
+
+    async def acall(self, *args, **kwargs):
+        """async __call__: awaits the area if it is async (used by the async Bot API)"""
+        return await run_async(self(*args, **kwargs))
@@ -6,7 +6,7 @@ author: Deniss Stepanovs
 from .entities import Signal
 from .signals import Matcher, NamedEntity
 from .actions import Trigger, Ask, Clarify, Confirm, Store, Say, Pause, Clear, Graph, Attend
-from . import config
+from .config import current_config
 
 
 class Intent(Signal):
@@ -20,6 +20,29 @@ class Intent(Signal):
     # when True the intent can be always chosen (like Stop)
     _command = False
 
+    # the highest score the intent can give (None - unknown), lets Attention skip hopeless intents
+    _max_score = None
+
+    # words/phrases without which the score is 0 (None - always scored), Attention scores the intent only if
+    # one of them is in the message
+    _keywords = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # bound and keywords belong to the score of the class declaring them: new score, unknown ones
+        if 'score' in cls.__dict__:
+            if '_max_score' not in cls.__dict__:
+                cls._max_score = None
+            if '_keywords' not in cls.__dict__:
+                cls._keywords = None
+            if 'upper_bound' not in cls.__dict__:
+                cls.upper_bound = Intent.__dict__['upper_bound']
+
+    @classmethod
+    def upper_bound(cls, message, **kwargs):
+        """Upper bound of score for the message (None - unknown), must be cheap: the intent is not created yet"""
+        return cls._max_score
+
     def score(self, message, **kwargs):
         """Depending on message.[text], outputs score, usually [0-1]"""
         raise NotImplementedError("Please Implement this method")
@@ -30,13 +53,15 @@ class Stop(Intent):
     Cleans areas: attention, actions
     """
     _command = True
+    _max_score = 1
+    _keywords = ['stop']
 
     def score(self, message, **kwargs):
-        text = message.text
-        return int(text.lower() in {'stop'})
+        return int(message.features.lower in {'stop'})
 
     def __call__(self, _areas=None, **kwargs):
         # cleating areas: actions, attention
+        config = current_config()
         stop_actions = []
 
         if config.SHOW_STOP_MESSAGE:
@@ -57,12 +82,15 @@ class Restart(Intent):
     """Cleans all (stateful) areas"""
 
     _command = True
+    _max_score = 1
+    _keywords = ['restart']
 
     def score(self, message, **kwargs):
-        return int(message.text.lower() in {'restart'})
+        return int(message.features.lower in {'restart'})
 
     def __call__(self, _areas, **kwargs):
         # cleaning everything
+        config = current_config()
         restart_actions = []
 
         if config.SHOW_RESARTED_MESSAGE:
@@ -79,6 +107,8 @@ class Restart(Intent):
 
 
 class Echo(Intent):
+    _max_score = 0.01
+
     def score(self, message, **kwargs):
         return 0.01
 
@@ -87,14 +117,18 @@ class Echo(Intent):
 
 
 class FirstMessage(Intent):
+    _max_score = 2
+
     def score(self, message, **kwargs):
-        return 2 * int(config.SHOW_WELCOME_MESSAGE and kwargs.get('is_first_message', False))
+        return 2 * int(current_config().SHOW_WELCOME_MESSAGE and kwargs.get('is_first_message', False))
 
     def __call__(self, *args, **kwargs):
-        return Say(text=config.MESSAGE_WELCOME)
+        return Say(text=current_config().MESSAGE_WELCOME)
 
 
 class ImageReceiver(Intent):
+    _max_score = 1
+
     def score(self, message, **kwargs):
         return bool(message.image)
 
@@ -103,6 +137,8 @@ class ImageReceiver(Intent):
 
 
 class NonText(Intent):
+    _max_score = 1
+
     def score(self, message, **kwargs):
         return bool(not message.text)
 
@@ -121,6 +157,9 @@ class NonText(Intent):
 
 
 class Grapher(Intent):
+    _max_score = 1
+    _keywords = ['start']
+
     def score(self, message, **kwargs):
         return message.text in {'start'}
 
@@ -140,8 +179,11 @@ class Grapher(Intent):
 
 
 class AttendIntent(Intent):
+    _max_score = 1
+    _keywords = ['name', 'age']
+
     def score(self, message, **kwargs):
-        return message.text.lower().strip('.?\n!') in {'my name is bob and my age is 1',
+        return message.features.lower.strip('.?\n!') in {'my name is bob and my age is 1',
                                                        'my name is bob',
                                                        'my age is 1',
                                                        'age name'}
@@ -160,6 +202,8 @@ class AttendIntent(Intent):
 
 
 class Profiler(Intent):
+    _max_score = 1
+
     def process(self, _areas, **kwargs):
         message = self.message
         if message._intent:
@@ -4,7 +4,20 @@ Contains wrappers for modern NLP tools like Spacy and Rasa.
 author: Deniss Stepanovs
 """
 import json, re
+import os
+import pickle
+import hashlib
 import logging
+import threading
+import time
+import gc
+import queue
+import asyncio
+from copy import deepcopy
+from itertools import chain, count
+from concurrent.futures import Future
+
+from .utils import LRUCache, TextFeatures, AhoCorasick, MultiPattern, words_regex
 
 
 class NlpData:
@@ -12,23 +25,107 @@ class NlpData:
                               r'\]\((?P<entity>\w*?)'
                               r'(?::(?P<value>[^)]+))?\)')  # [entity_text](entity_type(:entity_synonym)?)
 
+    md_item_regex = re.compile(r'[-*+]\s+(.+)')
+    # where examples start in json: top level list or rasa's common_examples
+    json_examples_regex = re.compile(r'^\s*\[|"common_examples"\s*:\s*\[')
+    json_separator_regex = re.compile(r'[\s,]*')
+
+    # streaming: characters read at once
+    chunk_size = 1 << 16
+
+    def _md_example(self, p, intent):
+        text = self.entity_regex.sub(r'\1', p)
+        entities = [dict(value=e[0], entity=e[1]) for e in self.entity_regex.findall(p)]
+        return dict(entities=entities, intent=intent, text=text)
+
     def from_md(self, text_md):
         r = dict()
         block_content = re.findall(r'#+\s*([^\n]+)([^#]+)', text_md)
         for block, content in block_content:
-            r[block.strip()] = [l.strip() for l in re.findall(r'[-*+]\s+(.+)', content)]
+            r[block.strip()] = [l.strip() for l in self.md_item_regex.findall(content)]
 
         data = []
         for k, pp in r.items():
             for p in pp:
                 what, value = map(str.strip, k.split(':'))
                 if what == 'intent':
-                    text = self.entity_regex.sub(r'\1', p)
-                    entities = [dict(value=e[0], entity=e[1]) for e in self.entity_regex.findall(p)]
-                    data.append(dict(entities=entities, intent=value, text=text))
+                    data.append(self._md_example(p, value))
 
         return data
 
+    def _stream_md(self, lines):
+        """md lines -> examples, block by block"""
+        intent = None
+        for line in lines:
+            if line.lstrip().startswith('#'):
+                what, _, value = line.strip().lstrip('#').partition(':')
+                intent = value.strip() if what.strip() == 'intent' else None
+            elif intent is not None:
+                for p in self.md_item_regex.findall(line):
+                    yield self._md_example(p.strip(), intent)
+
+    def _stream_json(self, file, buffer=''):
+        """json file (list of examples or rasa format) -> examples, decoding one example at a time"""
+        decoder = json.JSONDecoder()
+
+        # finding the examples list
+        m = self.json_examples_regex.search(buffer)
+        while m is None:
+            chunk = file.read(self.chunk_size)
+            if not chunk:
+                logging.error('no examples found in json training data')
+                return
+            buffer += chunk
+            m = self.json_examples_regex.search(buffer)
+
+        position = m.end()
+        while True:
+            position = self.json_separator_regex.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                example, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the example is not read completely
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield example
+
+    def _stream_file(self, file):
+        # the first meaningful character tells the format (json can be a single huge line)
+        first_char = file.read(1)
+        while first_char.isspace():
+            first_char = file.read(1)
+
+        if first_char in {'[', '{'}:
+            yield from self._stream_json(file, first_char)
+        else:
+            yield from self._stream_md(chain([first_char + file.readline()], file))
+
+    @classmethod
+    def stream(cls, obj):
+        """
+        Yields examples one by one, the file is never read as a whole (md, json or rasa json format).
+
+        :param obj: file name, file or examples (list or rasa-like dict)
+        """
+        if type(obj) == str:
+            with open(obj) as file:
+                yield from cls()._stream_file(file)
+
+        elif hasattr(obj, 'read'):
+            yield from cls()._stream_file(obj)
+
+        elif type(obj) == dict and 'rasa_nlu_data' in obj:
+            yield from obj['rasa_nlu_data']['common_examples']
+
+        else:
+            yield from obj
+
     def _readfile(self, file=None, filename=None):
         if filename is not None:
             file = open(filename)
@@ -49,7 +146,7 @@ class NlpData:
 
         return data
 
-    def __init__(self, obj):
+    def __init__(self, obj=None):
         if type(obj) == str:
             # file name
             self.data = self._readfile(filename=obj)
@@ -60,15 +157,60 @@ class NlpData:
         else:
             self.data = obj
 
+    @staticmethod
+    def fingerprint(data):
+        """content hash of training data (or anything json-like)"""
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def fingerprint_stream(cls, obj):
+        """same as fingerprint(NlpData(obj).data), but examples are streamed"""
+        sha1 = hashlib.sha1(b'[')
+        for i, example in enumerate(cls.stream(obj)):
+            sha1.update(((', ' if i else '') + json.dumps(example, sort_keys=True, default=repr)).encode('utf-8'))
+        sha1.update(b']')
+        return sha1.hexdigest()
+
 
 class Nlp:
     _entity_keys = {'entity', 'value', 'confidence', 'start', 'end'}
     _intent_keys = {'intent', 'confidence'}
 
+    # results cache: max number of texts (0 - no caching), seconds to live (None - forever)
+    cache_size = 1024
+    cache_ttl = None
+    # text -> cache key, e.g. botium.utils.clean_text (NB! entities of the first text are given to all texts
+    # with the same key)
+    cache_normalizer = None
+
+    _cache_lock = threading.Lock()
+
+    # lazy NLP (see Message.attach_nlp): messages the engine was attached to and really called for
+    _n_attached = 0
+    _n_called = 0
+
     @staticmethod
     def _transform_data(data):
         return NlpData(data).data
 
+    @staticmethod
+    def _stream_source(data):
+        """
+        training data that can be streamed (NlpData.stream) several times: file names and lists are kept as is,
+        file objects and other iterables are read into memory
+        """
+        if type(data) in {str, list, tuple} or (type(data) == dict and 'rasa_nlu_data' in data):
+            return data
+        return list(NlpData.stream(data))
+
+    def _examples(self):
+        """training examples, one by one"""
+        return NlpData.stream(self.data)
+
+    def _model_path(self, cache_dir, *settings):
+        """where the trained model for given training data and settings is kept"""
+        return os.path.join(cache_dir, '%s-%s' % (self.__class__.__name__, NlpData.fingerprint(settings)))
+
     def _validate(self, result):
         for entity in result['entities']:
             if not {'entity', 'value'}.issubset(entity):
@@ -82,9 +224,82 @@ class Nlp:
         """text -> dict(intent_ranking=..., entities=...)"""
         raise AttributeError('please define .predict method')
 
+    def predict_batch(self, texts):
+        """[text, ...] -> [predict(text), ...], override if the engine can do it faster at once"""
+        return [self.predict(text) for text in texts]
+
+    def intent_names(self):
+        """intents the engine can predict (None - unknown), lets messages skip NLP when no such intent is weighed"""
+        return None
+
+    def _count_call(self, attached):
+        with self._cache_lock:
+            if attached:
+                self._n_attached += 1
+            else:
+                self._n_called += 1
+
+    def calls_info(self):
+        """how many NLP calls lazy messages needed and how many were avoided"""
+        return dict(attached=self._n_attached, called=self._n_called, avoided=self._n_attached - self._n_called)
+
+    @property
+    def _cache(self):
+        # engines don't call Nlp.__init__, so the cache is created on the first use
+        if '_results_cache' not in self.__dict__:
+            with self._cache_lock:
+                if '_results_cache' not in self.__dict__:
+                    self._results_cache = LRUCache(maxsize=self.cache_size, ttl=self.cache_ttl)
+        return self._results_cache
+
+    def _cache_key(self, text):
+        return self.cache_normalizer(text) if self.cache_normalizer is not None else text
+
+    def cache_info(self):
+        return self._cache.info()
+
+    def cache_clear(self):
+        self._cache.clear()
+
+    def _cached(self, text):
+        """copy of the cached result (callers may change it) or None"""
+        result = self._cache.get(self._cache_key(text)) if self.cache_size else None
+        return deepcopy(result) if result is not None else None
+
+    def _formatted(self, text, predict_result):
+        """formats and caches the result of predict"""
+        result = self._format(predict_result)
+        if self.cache_size:
+            self._cache.set(self._cache_key(text), deepcopy(result))
+        return result
+
+    def batch(self, texts):
+        """same as __call__ for many texts"""
+        texts = list(texts)
+        results = [self._cached(text) for text in texts]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            for i, predict_result in zip(missing, self.predict_batch([texts[i] for i in missing])):
+                results[i] = self._formatted(texts[i], predict_result)
+
+        return results
+
     def __call__(self, text):
-        predict_result = self.predict(text)
+        return self.batch([text])[0]
+
+    async def apredict(self, text):
+        """async predict, by default .predict runs in the loop's executor (override if the engine is async)"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.predict, text)
+
+    async def acall(self, text):
+        """async __call__"""
+        result = self._cached(text)
+        if result is None:
+            result = self._formatted(text, await self.apredict(text))
+        return result
 
+    def _format(self, predict_result):
         result = dict()
         result["entities"] = predict_result.get("entities", [])
         result["entities"] = [{k: v for k, v in entity.items() if k in self._entity_keys} for entity in
@@ -101,14 +316,36 @@ class Nlp:
 
 
 class RasaNlp(Nlp):
-    def __init__(self, file_name, lang='en'):
+    """
+    Rasa NLU engine.
+
+    If cache_dir is given, the trained model is persisted there and loaded instead of training next time
+    (as long as the training file and settings are the same).
+    """
+
+    def __init__(self, file_name, lang='en', cache_dir=None):
         from rasa_nlu.training_data import load_data
         from rasa_nlu.config import RasaNLUConfig
-        from rasa_nlu.model import Trainer
+        from rasa_nlu.model import Trainer, Interpreter
+
+        pipeline = "spacy_sklearn"
+        rasa_config = RasaNLUConfig(cmdline_args=dict(pipeline=pipeline, language=lang))
+
+        model_dir = None
+        if cache_dir is not None:
+            with open(file_name, 'rb') as f:
+                data_hash = hashlib.sha1(f.read()).hexdigest()
+            model_dir = self._model_path(cache_dir, data_hash, lang, pipeline)
 
-        self.data = load_data(file_name)
-        self._trainer = Trainer(RasaNLUConfig(cmdline_args=dict(pipeline="spacy_sklearn", language=lang)))
-        self._interpreter = self._trainer.train(self.data)
+        if model_dir is not None and os.path.isdir(model_dir):
+            self._interpreter = Interpreter.load(model_dir, rasa_config)
+        else:
+            self.data = load_data(file_name)
+            self._trainer = Trainer(rasa_config)
+            self._interpreter = self._trainer.train(self.data)
+            if model_dir is not None:
+                self._trainer.persist(os.path.dirname(model_dir), project_name='',
+                                      fixed_model_name=os.path.basename(model_dir))
 
     def predict(self, text):
         r = self._interpreter.parse(text)
@@ -126,7 +363,12 @@ class SpacyEntitiesNlp(Nlp):
         self._nlp = spacy.load(lang)
 
     def predict(self, text):
-        doc = self._nlp(text)
+        return self._result(self._nlp(text))
+
+    def predict_batch(self, texts):
+        return [self._result(doc) for doc in self._nlp.pipe(texts)]
+
+    def _result(self, doc):
         entities = []
         for ent in doc.ents:
             entities.append(dict(entity=ent.label_,
@@ -135,26 +377,190 @@ class SpacyEntitiesNlp(Nlp):
 
 
 class SpacySklearnNlp(Nlp):
-    def __init__(self, data, lang='en', clf=None):
+    """
+    Spacy vectors + sklearn classifier.
+
+    If cache_dir is given, the trained classifier is saved there and loaded instead of fitting next time
+    (as long as training data, spacy model and classifier settings are the same).
+    Vectors of training texts are kept there too: retraining with a few new examples (.add_examples + .refit)
+    runs spacy only for the new texts.
+    """
+
+    def __init__(self, data, lang='en', clf=None, cache_dir=None):
         import spacy
         from sklearn.linear_model import LogisticRegression
 
-        self.data = self._transform_data(data)
+        # streamed when needed: large corpora are not kept in memory
+        self.data = self._stream_source(data)
         self._nlp = spacy.load(lang)
         self._clf = clf if clf is not None else LogisticRegression(C=100)
+        self.cache_dir = cache_dir
 
-        self.fit()
+        # examples added after the start, and those not trained on yet
+        self._added_examples = []
+        self._new_examples = []
+
+        meta = getattr(self._nlp, 'meta', {})
+        self._spacy_settings = (lang, meta.get('name'), meta.get('version'))
+
+        # text -> spacy vector
+        self._vectors = {}
+        self._vectors_file = None
+        if cache_dir is not None:
+            self._vectors_file = self._model_path(cache_dir, 'vectors', *self._spacy_settings) + '.pkl'
+            self._vectors = self._load_vectors(self._vectors_file)
+
+        self._model_file = self._model_filename()
+        if not self.load():
+            self.fit()
+            self.save()
+
+    def _examples(self):
+        return chain(NlpData.stream(self.data), self._added_examples)
+
+    def _model_filename(self):
+        if self.cache_dir is None:
+            return None
+        return self._model_path(self.cache_dir, NlpData.fingerprint_stream(self._examples()), *self._spacy_settings,
+                                self._clf.__class__.__name__, self._clf.get_params()) + '.pkl'
+
+    @staticmethod
+    def _dump_pickle(obj, filename):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # writing to a temporary file first: other workers may be loading it
+        with open(filename + '.tmp%d' % os.getpid(), 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(filename + '.tmp%d' % os.getpid(), filename)
+
+    @staticmethod
+    def _load_pickle(filename):
+        """None if there is nothing (valid) to load"""
+        if filename is None or not os.path.isfile(filename):
+            return None
+
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            logging.warning('failed to load %s' % filename)
+            return None
+
+    @staticmethod
+    def _append_vectors(vectors, filename):
+        """appends vectors to the file (a pickled dict per call), the vectors already there are not rewritten"""
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # one write: other workers may be appending too
+        fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, pickle.dumps(vectors))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _load_vectors(filename):
+        """text -> vector from all pickled dicts of the file (what is valid of it)"""
+        vectors = {}
+        if not os.path.isfile(filename):
+            return vectors
+
+        with open(filename, 'rb') as f:
+            while True:
+                try:
+                    vectors.update(pickle.load(f))
+                except EOFError:
+                    break
+                except Exception:
+                    logging.warning('failed to load (the end of) %s' % filename)
+                    break
+        return vectors
+
+    def save(self, filename=None):
+        """saves trained classifier (to the cache_dir by default)"""
+        filename = filename if filename is not None else self._model_file
+        if filename is None:
+            return False
+
+        self._dump_pickle(self._clf, filename)
+        return True
+
+    def load(self, filename=None):
+        """loads trained classifier (from the cache_dir by default), False if there is nothing to load"""
+        clf = self._load_pickle(filename if filename is not None else self._model_file)
+        if clf is None:
+            return False
+
+        self._clf = clf
+        # predictions of the old model
+        self.cache_clear()
+        return True
+
+    def _vectorize(self, texts):
+        """texts -> vectors, spacy runs only for texts without cached vectors"""
+        texts = list(texts)
+        new_texts = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        new_vectors = {text: doc.vector for text, doc in zip(new_texts, self._nlp.pipe(new_texts))}
+        self._vectors.update(new_vectors)
+
+        if new_vectors and self._vectors_file is not None:
+            self._append_vectors(new_vectors, self._vectors_file)
+
+        return [self._vectors[text] for text in texts]
 
     def fit(self):
-        X = [self._nlp(d['text']).vector for d in self.data]
-        intents = [d['intent'] for d in self.data]
-        self._clf.fit(X, intents)
+        texts, intents = [], []
+        for d in self._examples():
+            texts.append(d['text'])
+            intents.append(d['intent'])
+        self._clf.fit(self._vectorize(texts), intents)
+        self._new_examples = []
+        self.cache_clear()
+
+    def add_examples(self, examples):
+        """adds training examples (NlpData: file or list of examples), they are used after .refit()"""
+        examples = list(NlpData.stream(examples))
+        self._added_examples += examples
+        self._new_examples += examples
+
+    def refit(self):
+        """
+        Trains on the added examples: classifiers with partial_fit are updated with the new examples only
+        (as long as there are no new intents), others are trained again on cached vectors.
+        """
+        if not self._new_examples:
+            return
+
+        self._model_file = self._model_filename()
+        if self.load():
+            # already trained on the same examples
+            self._new_examples = []
+            return
+
+        intents = [d['intent'] for d in self._new_examples]
+        if hasattr(self._clf, 'partial_fit') and set(intents).issubset(getattr(self._clf, 'classes_', [])):
+            self._clf.partial_fit(self._vectorize(d['text'] for d in self._new_examples), intents)
+            self._new_examples = []
+            self.cache_clear()
+        else:
+            self.fit()
+        self.save()
+
+    def intent_names(self):
+        return list(self._clf.classes_)
 
     def predict(self, text):
         doc = self._nlp(text)
-        vector = doc.vector
-        probas = self._clf.predict_proba([vector])[0]
-
+        probas = self._clf.predict_proba([doc.vector])[0]
+        return self._result(doc, probas)
+
+    def predict_batch(self, texts):
+        docs = list(self._nlp.pipe(texts))
+        if not docs:
+            return []
+        # one matrix for all texts
+        probas = self._clf.predict_proba([doc.vector for doc in docs])
+        return [self._result(doc, p) for doc, p in zip(docs, probas)]
+
+    def _result(self, doc, probas):
         intents = [dict(intent=intent, confidence=confidence) for intent, confidence in
                    zip(self._clf.classes_, probas)]
 
@@ -165,31 +571,378 @@ class SpacySklearnNlp(Nlp):
         return dict(entities=entities, intents=intents)
 
 
-class TestNlp(Nlp):
-    """Used only for tests"""
+class TfidfNlp(Nlp):
+    """
+    Light intent classifier: TF-IDF of word and character n-grams + nearest centroid. Requires only numpy.
 
-    def extract_entities(self, text):
-        # text = "i am from latvia"
-        patterns = [r"from (?P<location>\w+)",
-                    r"(?P<location>riga|heidelberg)",
+    Confidences are softmax of cosine similarities to the intents' centroids (sharpened by 1/temperature).
+    Entities are not extracted.
+
+    :param data: training data (NlpData: md/json/rasa file or list of examples)
+    :param word_ngrams: sizes of word n-grams
+    :param char_ngrams: sizes of character n-grams
+    :param min_df: features found in fewer examples are dropped
+    """
+
+    def __init__(self, data, word_ngrams=(1, 2), char_ngrams=(2, 3, 4), min_df=1, temperature=0.1):
+        import numpy
+
+        self._np = numpy
+        self.word_ngrams = word_ngrams
+        self.char_ngrams = char_ngrams
+        self.min_df = min_df
+        self.temperature = temperature
+
+        # streamed when needed: large corpora are not kept in memory
+        self.data = self._stream_source(data)
+        self.fit()
+
+    def _features(self, text):
+        """text -> [feature, ...] (with repetitions)"""
+        features = TextFeatures(text)
+        words = features.words
+        result = []
+        for n in self.word_ngrams:
+            result += ['w:' + ' '.join(words[i:i + n]) for i in range(len(words) - n + 1)]
+        for n in self.char_ngrams:
+            result += ['c:' + ngram for ngram in features.ngrams(n)]
+        return result
+
+    def _vectorize(self, features):
+        """features -> (column ids, l2-normalized tf-idf values), unknown features are skipped"""
+        np = self._np
+        counts = {}
+        for feature in features:
+            i = self._vocabulary.get(feature)
+            if i is not None:
+                counts[i] = counts.get(i, 0) + 1
+        if not counts:
+            return None, None
+
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self._idf[ids]
+        return ids, values / np.linalg.norm(values)
+
+    def fit(self):
+        np = self._np
+
+        # first pass: document frequencies and intents
+        df = {}
+        intents = set()
+        n_examples = 0
+        for d in self._examples():
+            if d.get('intent'):
+                n_examples += 1
+                intents.add(d['intent'])
+                for feature in set(self._features(d['text'])):
+                    df[feature] = df.get(feature, 0) + 1
+
+        # vocabulary: features with enough document frequency
+        features = sorted(f for f, n in df.items() if n >= self.min_df)
+        self._vocabulary = {f: i for i, f in enumerate(features)}
+        self._idf = np.array([np.log((1 + n_examples) / (1 + df[f])) + 1 for f in features], dtype=np.float32)
+        del df
+
+        # second pass: centroids of normalized example vectors (features x intents)
+        self.classes_ = sorted(intents)
+        class_ids = {intent: i for i, intent in enumerate(self.classes_)}
+        self._centroids = np.zeros((len(features), len(self.classes_)), dtype=np.float32)
+        for d in self._examples():
+            if d.get('intent'):
+                ids, values = self._vectorize(self._features(d['text']))
+                if ids is not None:
+                    self._centroids[ids, class_ids[d['intent']]] += values
+
+        norms = np.linalg.norm(self._centroids, axis=0)
+        self._centroids /= np.where(norms > 0, norms, 1)
+
+    def intent_names(self):
+        return self.classes_
+
+    def predict(self, text):
+        np = self._np
+        ids, values = self._vectorize(self._features(text))
+        if ids is None:
+            similarities = np.zeros(len(self.classes_), dtype=np.float32)
+        else:
+            similarities = values @ self._centroids[ids]
 
-                    r"am (?P<age>\d+)",
-                    r"age is (?P<age>\d+)",
+        exp = np.exp((similarities - similarities.max()) / self.temperature)
+        probas = exp / exp.sum()
+
+        intents = [dict(intent=intent, confidence=float(p)) for intent, p in zip(self.classes_, probas)]
+        return dict(entities=[], intents=intents)
+
+
+class RuleNlp(Nlp):
+    """
+    Rule-based entity extractor: regexes with named groups + gazetteers (lists of entity values).
+
+    Regexes are compiled once. Each regex reports all its matches, entity names are the group names.
+    Gazetteers are matched word by word (case insensitive, whole words only) with one Aho-Corasick automaton,
+    overlapping values are resolved leftmost-longest.
+
+    :param patterns: list of regexes (strings or compiled), e.g. r"from (?P<location>\w+)"
+    :param gazetteers: {entity: values or file name (one value per line)}
+    :param flags: flags for string patterns
+    """
+
+    patterns = []
+    gazetteers = {}
+
+    def __init__(self, patterns=None, gazetteers=None, flags=re.IGNORECASE):
+        patterns = patterns if patterns is not None else self.patterns
+        gazetteers = gazetteers if gazetteers is not None else self.gazetteers
+
+        self._regexes = [re.compile(p, flags) if type(p) == str else p for p in patterns]
+        self._prefilter = self._compile_prefilter(self._regexes)
+
+        # value (tuple of words) -> entities
+        values = {}
+        for entity, entity_values in gazetteers.items():
+            for value in self._read_values(entity_values):
+                words = tuple(words_regex.findall(value.lower()))
+                if words:
+                    values.setdefault(words, [])
+                    if entity not in values[words]:
+                        values[words].append(entity)
+
+        self._automaton = AhoCorasick(values) if values else None
+        self._value_entities = list(values.values())
+
+    @staticmethod
+    def _read_values(values):
+        if type(values) != str:
+            return values
+        with open(values) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    @staticmethod
+    def _compile_prefilter(regexes):
+        """all regexes in one (without group names): if it doesn't match, none of the rules does"""
+        flags = set(r.flags for r in regexes)
+        flags = flags.pop() if len(flags) == 1 else None
+        if flags is None or flags & re.VERBOSE or \
+                any(MultiPattern._uncombinable_regex.search(r.pattern) or '(?P=' in r.pattern for r in regexes):
+            return None
+
+        pattern = '|'.join('(?:%s)' % re.sub(r'\(\?P<\w+>', '(?:', r.pattern) for r in regexes)
+        try:
+            return re.compile(pattern, flags)
+        except (re.error, OverflowError, AssertionError):
+            return None
 
-                    r"name is (?P<name>\w+)",
-                    r"(?P<location>bob|alice)",
-                    ]
+    def extract_regex_entities(self, text):
+        if not self._regexes or (self._prefilter is not None and not self._prefilter.search(text)):
+            return []
 
         entities = []
-        for pattern in patterns:
-            for m in re.finditer(pattern, text, re.IGNORECASE):
-                if m:
-                    for entity, value in m.groupdict().items():
+        for regex in self._regexes:
+            for m in regex.finditer(text):
+                for entity, value in m.groupdict().items():
+                    if value is not None:
                         entities.append(dict(entity=entity,
                                              value=value,
-                                             start=m.start(1),
-                                             end=m.end(1)))
+                                             start=m.start(entity),
+                                             end=m.end(entity)))
         return entities
 
+    def extract_gazetteer_entities(self, text):
+        if self._automaton is None:
+            return []
+
+        spans = [m.span() for m in words_regex.finditer(text)]
+        words = [text[start:end].lower() for start, end in spans]
+
+        # leftmost-longest, non overlapping
+        found = sorted(self._automaton.finditer(words), key=lambda x: (x[0], -x[1]))
+        entities = []
+        last_end = 0
+        for start, end, i in found:
+            if start < last_end:
+                continue
+            last_end = end
+            for entity in self._value_entities[i]:
+                entities.append(dict(entity=entity,
+                                     value=text[spans[start][0]:spans[end - 1][1]],
+                                     start=spans[start][0],
+                                     end=spans[end - 1][1]))
+        return entities
+
+    def extract_entities(self, text):
+        return self.extract_regex_entities(text) + self.extract_gazetteer_entities(text)
+
+    def intent_names(self):
+        # no intents, unless .predict is redefined
+        return [] if type(self).predict is RuleNlp.predict else None
+
     def predict(self, text):
         return dict(entities=self.extract_entities(text))
+
+
+def _nlp_worker(nlp, requests, results, batch_size, batch_wait):
+    """ProcessPoolNlp's worker: collects requests into micro-batches and predicts them at once"""
+    stop = False
+    while not stop:
+        request = requests.get()
+        if request is None:
+            break
+
+        batch = [request]
+        n_texts = len(request[1])
+        deadline = time.time() + batch_wait
+        while n_texts < batch_size:
+            try:
+                request = requests.get(timeout=max(0., deadline - time.time()))
+            except queue.Empty:
+                break
+            if request is None:
+                stop = True
+                break
+            batch.append(request)
+            n_texts += len(request[1])
+
+        ids = [i for request_ids, _ in batch for i in request_ids]
+        texts = [text for _, request_texts in batch for text in request_texts]
+        try:
+            results.put((ids, nlp.predict_batch(texts), None))
+        except Exception:
+            # one bad text doesn't fail the others: the texts are predicted one by one
+            predictions, errors = [], []
+            for text in texts:
+                try:
+                    predictions.append(nlp.predict_batch([text])[0])
+                    errors.append(None)
+                except Exception as e:
+                    predictions.append(None)
+                    errors.append(repr(e))
+            results.put((ids, predictions, errors))
+
+
+class ProcessPoolNlp(Nlp):
+    """
+    Runs a loaded engine in forked worker processes (POSIX only): workers share the model's memory with the parent
+    and predict outside of its GIL. Texts are sent over a local queue, workers group them into micro-batches.
+
+    :param nlp: loaded Nlp engine
+    :param workers: number of worker processes
+    :param batch_size: max number of texts in a micro-batch
+    :param batch_wait: seconds a worker waits for more texts to fill a micro-batch
+    :param timeout: seconds to wait for a prediction (None - forever)
+
+    Examples
+    --------
+    >>> nlp = ProcessPoolNlp(SpacySklearnNlp('data.md'), workers=4)
+    >>> nlp('hi')
+    >>> nlp.close()
+    """
+
+    def __init__(self, nlp, workers=2, batch_size=32, batch_wait=0.002, timeout=None):
+        import multiprocessing
+
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+        self._ids = count()
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+
+        context = multiprocessing.get_context('fork')
+        self._requests = context.Queue()
+        self._results = context.Queue()
+
+        # objects created so far won't be touched by gc in workers: their memory pages stay shared
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        self._workers = [context.Process(target=_nlp_worker, daemon=True,
+                                         args=(nlp, self._requests, self._results, batch_size, batch_wait))
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def _receive(self):
+        """passes workers' results to the waiting callers"""
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+
+            # errors: None or error per text (None - predicted)
+            ids, predictions, errors = result
+            with self._futures_lock:
+                futures = [self._futures.pop(i) for i in ids]
+            for i, future in enumerate(futures):
+                if errors is None or errors[i] is None:
+                    future.set_result(predictions[i])
+                else:
+                    future.set_exception(RuntimeError('NLP worker failed: %s' % errors[i]))
+
+    def intent_names(self):
+        return self.nlp.intent_names()
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def _submit(self, texts):
+        """sends texts to the workers, returns futures of their predictions"""
+        if not self._workers:
+            raise RuntimeError('%s is closed' % self.__class__.__name__)
+
+        texts = list(texts)
+        ids = [next(self._ids) for _ in texts]
+        futures = [Future() for _ in texts]
+        with self._futures_lock:
+            self._futures.update(zip(ids, futures))
+
+        # big batches are shared between the workers
+        for i in range(0, len(texts), self.batch_size):
+            self._requests.put((ids[i:i + self.batch_size], texts[i:i + self.batch_size]))
+        return futures
+
+    def predict_batch(self, texts):
+        return [future.result(self.timeout) for future in self._submit(texts)]
+
+    async def apredict(self, text):
+        # no thread is blocked while the workers predict
+        return await asyncio.wait_for(asyncio.wrap_future(self._submit([text])[0]), self.timeout)
+
+    def close(self):
+        """stops the workers"""
+        if not self._workers:
+            return
+
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+        self._results.put(None)
+        self._receiver.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TestNlp(RuleNlp):
+    """Used only for tests"""
+
+    # text = "i am from latvia"
+    patterns = [r"from (?P<location>\w+)",
+                r"(?P<location>riga|heidelberg)",
+
+                r"am (?P<age>\d+)",
+                r"age is (?P<age>\d+)",
+
+                r"name is (?P<name>\w+)",
+                r"(?P<location>bob|alice)",
+                ]
@@ -0,0 +1,152 @@
+"""
+Contains Scheduler: wakes bots (sessions) when their time triggers are due.
+"""
+import heapq
+import itertools
+import threading
+import logging
+
+from .utils import current_time
+
+
+class Scheduler:
+    """
+    Process-wide index of sessions' due times (TimeCondition/IntervalCondition triggers, see Bot.due_time).
+
+    Due times are kept in a heap, so only due sessions are woken up, no session is polled.
+    A session has at most one due time: scheduling it again replaces the old one (old heap entries are skipped).
+
+    :param tick: min seconds between two wake-ups (triggers that stay due are checked at most this often)
+    :param backoff: seconds before a session whose callback failed is woken again, doubled for each next failure
+    :param max_backoff: max seconds between the retries
+
+    Examples
+    --------
+    >>> scheduler = Scheduler()
+    >>> sessions = BotSessions(MyBot, scheduler=scheduler)  # sessions are (re)scheduled after each use
+    >>> scheduler.start(lambda session_id: dispatcher.submit(session_id, sessions.check, session_id))
+    """
+
+    def __init__(self, tick=0.05, backoff=1., max_backoff=60.):
+        self.tick = tick
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # (due time, order, session_id)
+        self._heap = []
+        # session_id -> due time (heap entries with other times are outdated)
+        self._due = {}
+        self._order = itertools.count()
+        self._lock = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._counts = dict(woken=0, failed=0)
+        # session_id -> number of failed callbacks in a row
+        self._failures = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, session_id, due_time):
+        """sets session's due time (ms, see utils.current_time), None - nothing is due"""
+        with self._lock:
+            if due_time is None:
+                self._due.pop(session_id, None)
+                self._failures.pop(session_id, None)
+                return
+
+            if self._due.get(session_id) == due_time:
+                return
+            self._due[session_id] = due_time
+            heapq.heappush(self._heap, (due_time, next(self._order), session_id))
+            # too many outdated entries
+            if len(self._heap) > 2 * len(self._due) + 64:
+                self._heap = [(t, i, s) for t, i, s in self._heap if self._due.get(s) == t]
+                heapq.heapify(self._heap)
+            self._lock.notify()
+
+    def schedule_bot(self, session_id, bot):
+        """(re)schedules session according to its bot's triggers"""
+        self.schedule(session_id, bot.due_time())
+
+    def due_time(self, session_id):
+        with self._lock:
+            return self._due.get(session_id)
+
+    def _next_time(self):
+        # the earliest valid due time (outdated entries are dropped)
+        while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """removes and returns sessions that are due by now (ms)"""
+        now = current_time() if now is None else now
+        due = []
+        with self._lock:
+            while True:
+                next_time = self._next_time()
+                if next_time is None or next_time > now:
+                    break
+                _, _, session_id = heapq.heappop(self._heap)
+                del self._due[session_id]
+                due.append(session_id)
+        return due
+
+    def start(self, callback):
+        """
+        Starts a thread calling callback(session_id) for due sessions.
+
+        The callback should check the bot (Bot.check) and schedule the session again (BotSessions does it).
+        """
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def _run(self, callback):
+        while True:
+            with self._lock:
+                next_time = self._next_time()
+                while not self._stopped and (next_time is None or next_time > current_time()):
+                    self._lock.wait(None if next_time is None else (next_time - current_time()) / 1000)
+                    next_time = self._next_time()
+                if self._stopped:
+                    return
+
+            for session_id in self.pop_due():
+                with self._lock:
+                    self._counts['woken'] += 1
+                try:
+                    callback(session_id)
+                except Exception as e:
+                    logging.error('scheduler: session %s failed (%r)' % (session_id, e))
+                    self.retry(session_id)
+                else:
+                    with self._lock:
+                        self._failures.pop(session_id, None)
+
+            with self._lock:
+                # no busy loop if triggers stay due
+                self._lock.wait_for(lambda: self._stopped, self.tick)
+
+    def retry(self, session_id):
+        """reschedules a session whose callback failed: backoff seconds later, twice as long for each next failure"""
+        with self._lock:
+            n = self._failures.get(session_id, 0)
+            self._failures[session_id] = n + 1
+            self._counts['failed'] += 1
+            retry_time = current_time() + int(1000 * min(self.max_backoff, self.backoff * 2 ** n))
+            # the callback may have scheduled it again (BotSessions saves the bot anyway), not earlier than the retry
+            due_time = self._due.get(session_id)
+            self.schedule(session_id, max(due_time, retry_time) if due_time is not None else retry_time)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def info(self):
+        with self._lock:
+            return dict(scheduled=len(self._due), next_time=self._next_time(), **self._counts)
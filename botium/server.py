@@ -0,0 +1,248 @@
+"""
+Contains BotServer: a small asyncio HTTP/1.1 server for JSON APIs and webhooks (standard library only).
+"""
+import asyncio
+import json
+import queue
+import logging
+import traceback
+from http import HTTPStatus
+
+from .dispatcher import Dispatcher
+from .sessions import BotSessions, DEFAULT_SESSION, message_kwargs, session_id_of
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        self.status = status
+        self.message = message or HTTPStatus(status).phrase
+        super().__init__(self.message)
+
+
+class BotServer:
+    """
+    Serves bots of many sessions over HTTP/1.1 (JSON in, JSON out), with keep-alive and request pipelining.
+
+    The connections are handled by the event loop, the bots reply on a bounded thread pool (see Dispatcher):
+    requests of the same session are replied in order, different sessions in parallel.
+    If too many requests are waiting, the server answers 503.
+
+    Routes (the same as botium.ui.app):
+        POST /api        {"session_id": .., "text": ..} -> {"messages": [..]}
+        POST /api/batch  {"messages": [{"session_id": .., "text": ..}, ..]} -> {"results": [..]}
+        GET  /api/info   sessions and queue stats
+
+    Webhooks are added with .route: handler(data) runs in the pool, session(data) gives its session id.
+
+    :param sessions: BotSessions or a bot (other sessions get bots like it)
+    :param workers: number of threads replying
+    :param max_pending: max number of requests waiting for a thread
+    :param max_body: max size of request body (bytes)
+    :param keep_alive: seconds an idle connection is kept open
+
+    Examples
+    --------
+    >>> BotServer(BotSessions(MyBot, load=load_state, save=save_state)).run(port=8008)
+    """
+
+    def __init__(self, sessions, workers=8, max_pending=1024, max_body=1 << 20, keep_alive=75):
+        if not isinstance(sessions, BotSessions):
+            bot = sessions
+            sessions = BotSessions.from_bot(bot)
+            sessions.add(DEFAULT_SESSION, bot)
+        self.sessions = sessions
+        self.dispatcher = Dispatcher(workers=workers, max_pending=max_pending)
+        self.max_body = max_body
+        self.keep_alive = keep_alive
+
+        # (method, path) -> (handler, session), handlers run in the pool
+        self.routes = {}
+        self._server = None
+        self._connections = set()
+
+        self.route('POST', '/api', self._reply, session=self._session_id)
+        self.route('POST', '/api/batch', self._reply_batch)
+        self.route('GET', '/api/info', self.info)
+
+    def route(self, method, path, handler, session=None):
+        """
+        Adds a route.
+
+        :param handler: callable(data) returning json-serializable response, data - parsed json body (None for GET)
+        :param session: callable(data) returning session id (requests of a session are handled in order),
+            None - request is not bound to a session
+        """
+        self.routes[(method.upper(), path)] = (handler, session)
+
+    @staticmethod
+    def _session_id(data):
+        try:
+            return session_id_of(data)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    @staticmethod
+    def _message_kwargs(data):
+        try:
+            return message_kwargs(data)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    def _reply(self, data):
+        messages = self.sessions.reply(self._session_id(data), **self._message_kwargs(data))
+        return {'messages': messages}
+
+    def _reply_batch(self, data):
+        if not isinstance(data.get('messages'), list):
+            raise HttpError(400, 'list of messages is expected')
+        # all items are checked before any is replied
+        items = [(self._session_id(d), self._message_kwargs(d)) for d in data['messages']]
+        replies = self.sessions.reply_batch(items)
+        return {'results': [{'session_id': session_id, 'messages': messages}
+                            for (session_id, _), messages in zip(items, replies)]}
+
+    def info(self, data=None):
+        return dict(sessions=self.sessions.info(), dispatcher=self.dispatcher.stats())
+
+    async def _read_request(self, reader):
+        """reads one request: method, path, body, keep-alive"""
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HttpError(400)
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(411, 'chunked body is not supported, use Content-Length')
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HttpError(400, 'invalid Content-Length')
+        if not 0 <= length <= self.max_body:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length else b''
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return method.upper(), target.split('?', 1)[0], body, keep_alive
+
+    def _dispatch(self, method, path, body):
+        """starts handling of the request, returns awaitable result"""
+        if (method, path) not in self.routes:
+            if any(p == path for _, p in self.routes):
+                raise HttpError(405)
+            raise HttpError(404)
+        handler, session = self.routes[(method, path)]
+
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            raise HttpError(400, 'invalid json')
+        if method == 'POST' and not isinstance(data, dict):
+            raise HttpError(400, 'json object is expected')
+
+        session_id = session(data) if session is not None else object()
+        try:
+            future = self.dispatcher.submit(session_id, handler, data, block=False)
+        except queue.Full:
+            raise HttpError(503)
+        return asyncio.wrap_future(future)
+
+    @staticmethod
+    def _response(status, obj, keep_alive):
+        body = json.dumps(obj).encode()
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+            status, HTTPStatus(status).phrase, len(body), 'keep-alive' if keep_alive else 'close')
+        return head.encode('latin-1') + body
+
+    async def _respond(self, result, keep_alive):
+        try:
+            return self._response(200, await result, keep_alive)
+        except HttpError as e:
+            return self._response(e.status, {'error': e.message}, keep_alive)
+        except Exception as e:
+            logging.error('server: request failed (%r)' % e)
+            traceback.print_exc()
+            return self._response(500, {'error': 'internal error'}, keep_alive)
+
+    async def _write_responses(self, writer, responses):
+        # responses are written in the order of requests (pipelining)
+        while True:
+            response = await responses.get()
+            if response is None:
+                break
+            writer.write(await response)
+            await writer.drain()
+
+    def _failed(self, error):
+        result = asyncio.get_running_loop().create_future()
+        result.set_exception(error)
+        return result
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        responses = asyncio.Queue()
+        writing = asyncio.ensure_future(self._write_responses(writer, responses))
+        keep_alive = True
+        try:
+            while keep_alive:
+                try:
+                    method, path, body, keep_alive = await asyncio.wait_for(self._read_request(reader),
+                                                                            self.keep_alive)
+                except HttpError as e:
+                    # the rest of the stream can't be trusted
+                    keep_alive = False
+                    result = self._failed(e)
+                else:
+                    try:
+                        result = self._dispatch(method, path, body)
+                    except HttpError as e:
+                        result = self._failed(e)
+                # ready to read the next request while this one is being handled
+                await responses.put(asyncio.ensure_future(self._respond(result, keep_alive)))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            responses.put_nowait(None)
+            try:
+                await writing
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                writing.cancel()
+                writer.close()
+            self._connections.discard(writer)
+
+    async def start(self, host='127.0.0.1', port=8008):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def serve_forever(self, host='127.0.0.1', port=8008):
+        await self.start(host, port)
+        print('botium server is running on http://%s:%d' % (host, port))
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run(self, host='127.0.0.1', port=8008):
+        try:
+            asyncio.run(self.serve_forever(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.dispatcher.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # idle keep-alive connections are not waited for
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+        self.dispatcher.close(wait=False)
@@ -0,0 +1,323 @@
+"""
+Contains BotSessions: a bot per session (user), states are loaded and saved through hooks or a store.
+"""
+from contextlib import contextmanager, ExitStack
+from collections import OrderedDict
+import threading
+import sqlite3
+import json
+
+from .bots import Bot
+from .signals import Message
+from .utils import LRUCache, current_time
+
+# session of requests without session id
+DEFAULT_SESSION = 'default'
+
+
+def message_kwargs(data):
+    """
+    Message fields of a request (json object), session_id is dropped.
+    Only Message's fields (text, image, ...) of their types pass, ValueError for anything else.
+
+    Examples
+    --------
+    >>> sessions.reply(session_id, **message_kwargs(request_json))
+    """
+    if not isinstance(data, dict):
+        raise ValueError('json object is expected')
+    kwargs = {k: v for k, v in data.items() if k != 'session_id'}
+    for k, v in kwargs.items():
+        if k not in Message._prototype:
+            raise ValueError('unknown message field: %s' % k)
+        if not isinstance(v, Message._prototype[k]):
+            raise ValueError('%s should be %s' % (k, Message._prototype[k].__name__))
+    return kwargs
+
+
+def session_id_of(data):
+    """
+    Session id of a request (json object), DEFAULT_SESSION if there is none.
+    Only strings and integers pass (ids are keys of dicts and queues), ValueError for anything else.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('json object is expected')
+    session_id = data.get('session_id')
+    if session_id is not None and not isinstance(session_id, (str, int)):
+        raise ValueError('session_id should be str or int')
+    return session_id or DEFAULT_SESSION
+
+
+def _lock_order(session_id):
+    # sessions are locked in the same order by everyone (no deadlocks)
+    return type(session_id).__name__, str(session_id)
+
+
+class SqliteStore:
+    """
+    Bots' states in sqlite: json state and the next due time (Bot.due_time, indexed) of each session.
+
+    :param path: database file (':memory:' - in memory)
+    :param table: name of the table
+
+    Examples
+    --------
+    >>> sessions = BotSessions(MyBot, store=SqliteStore('states.sqlite3'))
+    >>> sessions.sweep()  # checks only the bots that are due
+    """
+    # max number of sessions per query
+    chunk_size = 500
+
+    def __init__(self, path='states.sqlite3', table='states'):
+        self.table = table
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS %s (session_id PRIMARY KEY, state TEXT, due_time INTEGER);"
+                             % table)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_%s_due_time ON %s (due_time);" % (table, table))
+
+    def load(self, session_id):
+        return self.load_many([session_id]).get(session_id)
+
+    def load_many(self, session_ids):
+        """session_id -> state of the sessions that are stored"""
+        states = {}
+        session_ids = list(session_ids)
+        with self._lock:
+            for start in range(0, len(session_ids), self.chunk_size):
+                chunk = session_ids[start:start + self.chunk_size]
+                rows = self._db.execute("SELECT session_id, state FROM %s WHERE session_id IN (%s);"
+                                        % (self.table, ','.join('?' * len(chunk))), chunk).fetchall()
+                states.update((session_id, json.loads(state)) for session_id, state in rows)
+        return states
+
+    def save(self, session_id, state, due_time=None):
+        self.save_many([(session_id, state, due_time)])
+
+    def save_many(self, items):
+        """saves (session_id, state, due_time) items in one transaction"""
+        rows = [(session_id, json.dumps(state), due_time) for session_id, state, due_time in items]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO %s VALUES (?, ?, ?);" % self.table, rows)
+
+    def due(self, now=None, limit=None):
+        """sessions that are due by now (ms), the earliest first"""
+        now = current_time() if now is None else now
+        with self._lock:
+            rows = self._db.execute("SELECT session_id FROM %s WHERE due_time <= ? ORDER BY due_time LIMIT ?;"
+                                    % self.table, (now, -1 if limit is None else limit)).fetchall()
+        return [session_id for session_id, in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class BotSessions:
+    """
+    Bots of many sessions. Recently used bots are kept in memory, others are restored from their states.
+
+    A session is used by one thread at a time (per-session lock), different sessions are used in parallel.
+    The state is saved (through save-hook or store) after each use, so a bot dropped from memory is never lost.
+
+    :param bot_factory: callable(state) returning a bot, e.g. Bot subclass
+    :param load: callable(session_id) returning saved state (None for a new session), default - states in memory
+    :param save: callable(session_id, state)
+    :param maxsize: max number of bots kept in memory
+    :param ttl: seconds a bot is kept in memory (None - forever)
+    :param scheduler: botium.scheduler.Scheduler, sessions are (re)scheduled after each use (time triggers)
+    :param store: SqliteStore (or alike), used instead of load/save hooks, keeps due times for .sweep
+    :param sink: botium.sinks.HttpSink (or alike), bots' messages are sent there (replies return no messages)
+
+    Examples
+    --------
+    >>> sessions = BotSessions(MyBot, load=load_state, save=save_state)
+    >>> sessions.reply('user-1', text='hi')
+    [{'text': 'Hi!'}]
+    """
+
+    def __init__(self, bot_factory=Bot, load=None, save=None, maxsize=1024, ttl=None, scheduler=None, store=None,
+                 sink=None):
+        self.bot_factory = bot_factory
+        self.scheduler = scheduler
+        self.sink = sink
+        self.store = store
+        if store is not None:
+            load = store.load
+        # default storage
+        elif load is None and save is None:
+            self.states = {}
+            load, save = self.states.get, self.states.__setitem__
+        self.load = load
+        self.save = save
+        self.bots = LRUCache(maxsize=maxsize, ttl=ttl)
+
+        # session_id -> [lock, number of threads using/waiting for it]
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bot(cls, bot, **kwargs):
+        """sessions of bots like the given one (same class, intents, nlp and config)"""
+        intents = list(bot._intents.values())
+
+        def bot_factory(state):
+            new_bot = bot.__class__(state=state, intents=intents, nlp=bot.nlp, executor=bot.executor)
+            new_bot.config = bot.config
+            return new_bot
+
+        return cls(bot_factory, **kwargs)
+
+    @contextmanager
+    def _locked(self, session_id):
+        with self._lock:
+            entry = self._locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[session_id]
+
+    def _new_bot(self, session_id, state):
+        bot = self.bot_factory(state)
+        if self.sink is not None:
+            bot.mouth._sink = self.sink.session(session_id)
+        return bot
+
+    def _get_bot(self, session_id):
+        bot = self.bots.get(session_id)
+        if bot is None:
+            bot = self._new_bot(session_id, self.load(session_id))
+            self.bots.set(session_id, bot)
+        return bot
+
+    @contextmanager
+    def session(self, session_id):
+        """
+        Locks the session and gives its bot, the state is saved when done.
+
+        Examples
+        --------
+        >>> with sessions.session('user-1') as bot:
+        ...     bot.reply(text='hi')
+        ...     messages = bot.mouth.pop_dicts()
+        """
+        with self._locked(session_id):
+            bot = self._get_bot(session_id)
+            try:
+                yield bot
+            finally:
+                self._saved(session_id, bot)
+
+    def _saved(self, session_id, bot):
+        if self.store is not None:
+            self.store.save(session_id, bot.state, bot.due_time())
+        elif self.save is not None:
+            self.save(session_id, bot.state)
+        if self.scheduler is not None:
+            self.scheduler.schedule_bot(session_id, bot)
+
+    def add(self, session_id, bot):
+        """puts an existing bot to the session"""
+        with self._locked(session_id):
+            if self.sink is not None:
+                bot.mouth._sink = self.sink.session(session_id)
+            self.bots.set(session_id, bot)
+            self._saved(session_id, bot)
+
+    def reply(self, session_id, **kwargs):
+        """bot of the session replies, returns bot's messages"""
+        with self.session(session_id) as bot:
+            bot.reply(**kwargs)
+            return bot.mouth.pop_dicts()
+
+    def check(self, session_id):
+        """checks bot's triggers (see Bot.check), returns bot's messages"""
+        with self.session(session_id) as bot:
+            bot.check()
+            return bot.mouth.pop_dicts()
+
+    def reply_batch(self, items):
+        """
+        Replies to several messages, messages of a session are replied in the given order.
+        NLP runs in batches (see Bot.reply_batch).
+
+        :param items: list of (session_id, kwargs) pairs
+        :return: list of bot's messages per item
+        """
+        # grouping by session
+        by_session = OrderedDict()
+        for i, (session_id, kwargs) in enumerate(items):
+            by_session.setdefault(session_id, []).append(i)
+
+        results = [None] * len(items)
+        with ExitStack() as stack:
+            bots = {session_id: stack.enter_context(self.session(session_id))
+                    for session_id in sorted(by_session, key=_lock_order)}
+
+            # i-th messages of all sessions go together
+            for i in range(max(len(indexes) for indexes in by_session.values()) if by_session else 0):
+                pending = [(session_id, indexes[i]) for session_id, indexes in by_session.items() if i < len(indexes)]
+                Bot.reply_batch([(bots[session_id], items[j][1]) for session_id, j in pending])
+                for session_id, j in pending:
+                    results[j] = bots[session_id].mouth.pop_dicts()
+
+        return results
+
+    def sweep(self, now=None, batch_size=256, executor=None):
+        """
+        Checks triggers of the bots that are due (see Bot.check), other bots are not even loaded.
+
+        Sessions of a batch are locked, loaded and saved at once, only changed states are saved.
+        Needs a store keeping due times (e.g. SqliteStore).
+
+        :param now: time (ms), default - current time
+        :param executor: concurrent.futures executor checking bots of a batch in parallel (None - one by one)
+        :return: list of (session_id, bot's messages), only sessions that said something
+        """
+        session_ids = self.store.due(now)
+        said = []
+        for start in range(0, len(session_ids), batch_size):
+            said += self._sweep_batch(session_ids[start:start + batch_size], executor)
+        return said
+
+    def _sweep_batch(self, session_ids, executor):
+        with ExitStack() as stack:
+            for session_id in sorted(session_ids, key=_lock_order):
+                stack.enter_context(self._locked(session_id))
+
+            # bots in memory are used as they are
+            bots = {session_id: self.bots.get(session_id) for session_id in session_ids}
+            states = self.store.load_many([session_id for session_id, bot in bots.items() if bot is None])
+
+            def check(session_id):
+                bot = bots[session_id]
+                if bot is None:
+                    state = states.get(session_id)
+                    bot = self._new_bot(session_id, state)
+                else:
+                    state = bot.state
+                bot.check()
+                messages = bot.mouth.pop_dicts()
+                new_state = bot.state
+                return session_id, bot, messages, new_state if new_state != state else None
+
+            results = list(executor.map(check, session_ids) if executor is not None else map(check, session_ids))
+            self.store.save_many([(session_id, state, bot.due_time())
+                                  for session_id, bot, _, state in results if state is not None])
+            if self.scheduler is not None:
+                for session_id, bot, _, _ in results:
+                    self.scheduler.schedule_bot(session_id, bot)
+
+        return [(session_id, messages) for session_id, _, messages, _ in results if messages]
+
+    def info(self):
+        """bots in memory and sessions in use"""
+        with self._lock:
+            in_use = len(self._locks)
+        return dict(self.bots.info(), in_use=in_use)
@@ -6,7 +6,7 @@ author: Deniss Stepanovs
 from .entities import Signal
 from .utils import *
 import logging
-from .config import config
+from .config import config, current_config
 
 from types import MethodType, FunctionType
 
@@ -31,14 +31,14 @@ class NamedEntity(Signal):
     _prototype = dict(name=str)
 
     def __call__(self, message, **kwargs):
-        if message._entities is not None:
-            for entity in message._entities:
-                if self.name.lower() == entity['entity'].lower():
-                    return Response(message=message, confidence=1, match=entity['value'])
-        else:
+        if not message.has_nlp():
             logging.warning("NamedEntities require NLP engine, but you haven't specified one. You need to provide "
                             "nlp=Nlp() where Nlp is a class of your NLP engine")
 
+        for entity in message._entities:
+            if self.name.lower() == entity['entity'].lower():
+                return Response(message=message, confidence=1, match=entity['value'])
+
         return Response(message=message, confidence=1, match=None)
 
 
@@ -52,14 +52,83 @@ class Message(Signal):
                       voice=str,
                       video=str)
 
-    _intents = []
-    _entities = []
+    @property
+    def features(self):
+        """lowercase, clean text, tokens, etc. computed once per message (not serialized)"""
+        text = self.text if self.text is not None else ''
+        if self._features is None or self._features.text is not text:
+            self._features = TextFeatures(text)
+        return self._features
 
     def attach_nlp(self, nlp):
-        if nlp:
-            _nlp = nlp(self.text)
-            self._entities = _nlp['entities']
-            self._intents = _nlp['intents']
+        """NLP engine runs later, only if entities or intents are read"""
+        if nlp and not self._nlp_attached and self._nlp is None:
+            self._nlp = nlp
+            self._count_nlp_call(attached=True)
+
+    def has_nlp(self):
+        """True if NLP results are (or can be) there"""
+        return self._nlp_attached or self._nlp is not None
+
+    def __getstate__(self):
+        # the engine is not pickled (e.g. for process pools), NLP results are
+        state = dict(self.__dict__)
+        state.pop('_nlp', None)
+        return state
+
+    def set_nlp(self, result):
+        """attaches already computed NLP result (e.g. from Nlp.batch)"""
+        self._nlp_result = result
+        self._nlp_attached = True
+
+    def _run_nlp(self):
+        if not self._nlp_attached and self._nlp is not None:
+            self._count_nlp_call(attached=False)
+            self.set_nlp(self._nlp(self.text))
+
+    async def arun_nlp(self):
+        """async version of running NLP: awaits engine's acall (if any)"""
+        if not self._nlp_attached and self._nlp is not None:
+            self._count_nlp_call(attached=False)
+            if hasattr(self._nlp, 'acall'):
+                self.set_nlp(await self._nlp.acall(self.text))
+            else:
+                self.set_nlp(await run_async(self._nlp(self.text)))
+
+    def _count_nlp_call(self, attached):
+        # any callable can be an engine, only Nlp ones count
+        if hasattr(self._nlp, '_count_call'):
+            self._nlp._count_call(attached)
+
+    @property
+    def _entities(self):
+        self._run_nlp()
+        return self._nlp_result['entities'] if self._nlp_attached else []
+
+    @property
+    def _intents(self):
+        self._run_nlp()
+        return self._nlp_result['intents'] if self._nlp_attached else []
+
+    def nlp_intents(self):
+        """hashes of intents NLP may give confidence to (NLP doesn't run if the engine knows its intents)"""
+        if self._nlp_intents is None:
+            names = None
+            if not self._nlp_attached and hasattr(self._nlp, 'intent_names'):
+                names = self._nlp.intent_names()
+            if names is None:
+                names = [d['intent'] for d in self._intents]
+            self._nlp_intents = {hash_text(name) for name in names}
+        return self._nlp_intents
+
+    def intent_confidence(self, name):
+        """NLP confidence of the intent (NLP runs only if it may know the intent)"""
+        name_hash = hash_text(name)
+        if name_hash not in self.nlp_intents():
+            return 0
+        if self._intent_confidence is None:
+            self._intent_confidence = {hash_text(d['intent']): d['confidence'] for d in self._intents}
+        return self._intent_confidence.get(name_hash, 0)
 
 
 class Desire(Signal):
@@ -105,6 +174,24 @@ class Trigger(Signal):
             triggered = self.trigger(event, **kwargs)
             return triggered
 
+    def due_time(self):
+        """the earliest time (ms) a time condition will be met, None if there is no such"""
+        if not self.triggered:
+            times = [condition.due_time() for condition in list_of(self.condition)]
+            times = [t for t in times if t is not None]
+            if times:
+                return min(times)
+
+    def depends_on(self):
+        """(signal name, event type) of the events that can trigger it, None - any event (see Condition.depends_on)"""
+        keys = []
+        for condition in list_of(self.condition):
+            condition_keys = condition.depends_on()
+            if condition_keys is None:
+                return None
+            keys += condition_keys
+        return keys
+
     def trigger(self, event, **kwargs):
         for condition in list_of(self.condition):
             triggered = condition(event, **kwargs)
@@ -121,9 +208,54 @@ class Matcher(Signal):
     _prototype = dict(
         options={int, float, type, str, re._pattern_type, NamedEntity, dict, bool, MethodType, FunctionType})
 
+    # results for deterministic options (shared by all matchers)
+    _cache = LRUCache(maxsize=config.MATCH_CACHE_SIZE)
+
+    @classmethod
+    def cache_info(cls):
+        return cls._cache.info()
+
+    @classmethod
+    def cache_clear(cls):
+        cls._cache.clear()
+
+    @classmethod
+    def _fingerprint(cls, options):
+        """hashable key of the options, None if result can't be cached (callables, NamedEntity, ...)"""
+        if type(options) == dict:
+            items = []
+            for match, _options in options.items():
+                fingerprint = cls._fingerprint(_options)
+                if fingerprint is None:
+                    return None
+                items.append((match, fingerprint))
+            return ('dict', tuple(items))
+
+        elif type(options) == list:
+            items = []
+            for option in options:
+                fingerprint = cls._fingerprint(option)
+                if fingerprint is None:
+                    return None
+                items.append(fingerprint)
+            return ('list', tuple(items))
+
+        elif options is None:
+            return ('none',)
+        elif type(options) == type and options in {int, float, bool, str}:
+            return ('type', options.__name__)
+        elif type(options) == re._pattern_type:
+            return ('re', options.pattern, options.flags)
+        elif type(options) in {int, float, bool, str}:
+            # type matters: 1, 1.0 and True are equal keys, but different options
+            return (type(options).__name__, options)
+
+        return None
+
     def _score(self, option, message, **kwargs):
         """scores a message vs. single option"""
         text = message.text
+        features = message.features
         if type(option) == type and option in {int, float}:
             try:
                 option(text)
@@ -132,8 +264,8 @@ class Matcher(Signal):
                 return {'match': None, 'confidence': 1}
 
         if type(option) == type and option == bool:
-            if text.lower() in {'true', 'false'}:
-                return {'match': text.lower(), 'confidence': 1}
+            if features.lower in {'true', 'false'}:
+                return {'match': features.lower, 'confidence': 1}
             else:
                 return {'match': None, 'confidence': 1}
 
@@ -143,19 +275,10 @@ class Matcher(Signal):
 
         # regex
         elif type(option) == re._pattern_type:
-            m = option.search(text)
-            if m:
-                # if more than one entity is present -> match=Text
-                d = {'match': m.group(1), 'confidence': 1}
-                # adding named things
-                if m.groupdict():
-                    d['entities'] = m.groupdict()
-                return d
-            else:
-                return {'match': None, 'confidence': 1}
+            return self._regex_score(option.search(text))
 
         elif callable(option):
-            res = option(message, **kwargs)
+            res = run_sync(option(message, **kwargs))
             # response from NamedEntity
             if type(res) == Response:
                 # add other things
@@ -172,7 +295,7 @@ class Matcher(Signal):
 
         elif type(option) == str:
             # minimum similarity for strings
-            similarity = levenshtein_similarity(option.lower(), text.lower()) if config.MATCH_LOWER_CASE else levenshtein_similarity(option, text)
+            similarity = levenshtein_similarity(option.lower(), features.lower) if current_config().MATCH_LOWER_CASE else levenshtein_similarity(option, text)
             if similarity > 0:
                 return {'match': option, 'confidence': levenshtein_similarity(option, text)}
             else:
@@ -183,22 +306,75 @@ class Matcher(Signal):
             logging.error("unknown type (%s) in Matcher" % option)
             return dict(match=None, confidence=0)
 
+    @staticmethod
+    def _regex_score(m):
+        if m:
+            # if more than one entity is present -> match=Text
+            d = {'match': m.group(1), 'confidence': 1}
+            # adding named things
+            if m.groupdict():
+                d['entities'] = m.groupdict()
+            return d
+        else:
+            return {'match': None, 'confidence': 1}
+
+    def _scores(self, options, message, **kwargs):
+        """scores a message vs. all options, regexes are matched together (see utils.MultiPattern)"""
+        patterns = tuple(option for option in options if type(option) == re._pattern_type)
+        if len(patterns) < 2:
+            return [self._score(option, message, **kwargs) for option in options]
+
+        # all regexes have the same confidence: only the first matching one can be the best,
+        # unless its group is empty (no match), then the next patterns are tried
+        first, m, offset = None, None, 0
+        while offset < len(patterns):
+            i, m = multi_pattern(patterns[offset:]).search(message.text)
+            if m is None or m.group(1) is not None:
+                first = offset + i if m is not None else None
+                break
+            offset += i + 1
+
+        scores = []
+        i = 0
+        for option in options:
+            if type(option) == re._pattern_type:
+                scores.append(self._regex_score(m if i == first else None))
+                i += 1
+            else:
+                scores.append(self._score(option, message, **kwargs))
+        return scores
+
     def scores(self, message, **kwargs):
         if type(self.options) == dict:
-            scores = []
-            for match, options in self.options.items():
-                _scores = [self._score(option, message, **kwargs) for option in options]
-                for s in _scores:
-                    if s['match'] is not None:
-                        s['match'] = match
-                    # adding named things
-                    s['entities'] = {match: message.text}
-                scores.extend(_scores)
+            matches = [match for match, options in self.options.items() for _ in options]
+            scores = self._scores([option for options in self.options.values() for option in options],
+                                  message, **kwargs)
+            for match, s in zip(matches, scores):
+                if s['match'] is not None:
+                    s['match'] = match
+                # adding named things
+                s['entities'] = {match: message.text}
             return scores
         else:
-            return [self._score(option, message, **kwargs) for option in list_of(self.options, keep_none=True)]
+            return self._scores(list_of(self.options, keep_none=True), message, **kwargs)
 
     def __call__(self, message, **kwargs):
+        active_config = current_config()
+        key = None
+        if active_config.MATCH_CACHE_SIZE and type(message.text) == str:
+            fingerprint = self._fingerprint(self.options)
+            if fingerprint is not None:
+                # matches can echo the text back, so it is used as is
+                key = (fingerprint, active_config.MATCH_LOWER_CASE, message.text)
+                # the cache is shared by all bots: its size is the global one
+                self._cache.maxsize = config.MATCH_CACHE_SIZE
+                cached = self._cache.get(key)
+                if cached is not None:
+                    best_match = dict(cached)
+                    if 'entities' in best_match:
+                        best_match['entities'] = dict(best_match['entities'])
+                    return Response(message=message, **best_match)
+
         scores = [d for d in self.scores(message, **kwargs) if d['match'] is not None]
 
         if scores:
@@ -206,6 +382,12 @@ class Matcher(Signal):
         else:
             best_match = dict(match=None, confidence=1)
 
+        if key is not None:
+            cached = dict(best_match)
+            if 'entities' in cached:
+                cached['entities'] = dict(cached['entities'])
+            self._cache.set(key, cached)
+
         best_match['message'] = message
         return Response(**best_match)
 
@@ -0,0 +1,246 @@
+"""
+Contains HttpSink: delivers bot's messages (what Mouth says) over HTTP, standard library only.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from urllib.parse import urlsplit
+import http.client
+import itertools
+import threading
+import heapq
+import json
+import time
+import logging
+
+
+class HttpSink:
+    """
+    Outbound messages: batched per session and across sessions, posted by a pool of threads over kept-alive
+    connections, in order per session.
+
+    A message with "delay" (ms, see Mouth) is sent that long after the previous message of the session,
+    waiting is done by a timer, workers never sleep. Failed requests are retried with exponential backoff.
+
+    :param url: where batches are posted as {"messages": [{"session_id": .., "text": ..}, ..]}
+    :param to_requests: callable(batch) returning list of (url, json body), batch - list of (session_id, message),
+        replaces the default format
+    :param batch_size: max number of messages per batch
+    :param batch_wait: seconds a batch waits for more messages
+    :param workers: number of threads (and connections per host) posting
+    :param retries: number of retries of a failed request (connection errors, 429 and 5xx statuses)
+    :param backoff: seconds before the first retry, doubled for each next one
+    :param timeout: seconds of http request
+    :param delays: apply "delay" of the messages
+
+    Examples
+    --------
+    >>> sink = HttpSink('http://localhost:9000/outbound')
+    >>> bot = Bot(sink=sink.session('user-1'))  # or BotSessions(MyBot, sink=sink)
+    >>> bot.reply(text='hi')  # bot's answer is posted
+    """
+
+    def __init__(self, url=None, to_requests=None, batch_size=64, batch_wait=0.02, workers=4, retries=3,
+                 backoff=0.2, timeout=10, delays=True):
+        self.url = url
+        self.to_requests = to_requests if to_requests is not None else self._default_requests
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.delays = delays
+
+        # session_id -> messages waiting
+        self._queues = {}
+        # sessions waiting for their timer or ready to go
+        self._scheduled = set()
+        self._ready = deque()
+        # sessions being delivered (next message waits)
+        self._busy = set()
+        # (time, order, session_id or None, retry or None)
+        self._timers = []
+        self._order = itertools.count()
+        self._retrying = 0
+        self._counts = dict(messages=0, requests=0, retries=0, failed=0)
+        self._closed = False
+        self._lock = threading.Condition()
+
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(workers)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _default_requests(self, batch):
+        return [(self.url, {'messages': [dict(message, session_id=session_id) for session_id, message in batch]})]
+
+    def session(self, session_id):
+        """sink of one session: callable(message), e.g. for Bot(sink=...)"""
+        return lambda message: self.send(session_id, message)
+
+    def send(self, session_id, messages):
+        """queues message (or list of messages) of the session"""
+        if isinstance(messages, dict):
+            messages = [messages]
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('sink is closed')
+            self._queues.setdefault(session_id, deque()).extend(messages)
+            self._schedule(session_id)
+            self._lock.notify_all()
+
+    def _delay(self, message):
+        return message.get('delay', 0) / 1000 if self.delays else 0
+
+    def _schedule(self, session_id):
+        # the first message of the session goes when its delay passes (the previous message is delivered)
+        if session_id in self._scheduled or session_id in self._busy or not self._queues.get(session_id):
+            return
+        self._scheduled.add(session_id)
+        delay = self._delay(self._queues[session_id][0])
+        if delay:
+            heapq.heappush(self._timers, (time.time() + delay, next(self._order), session_id, None))
+        else:
+            self._ready.append(session_id)
+
+    def _take(self, session_id):
+        # messages of the session for the batch: the first one and those without delay after it
+        queue = self._queues[session_id]
+        messages = [queue.popleft()]
+        while queue and not self._delay(queue[0]):
+            messages.append(queue.popleft())
+        if not queue:
+            del self._queues[session_id]
+        return messages
+
+    def _due_timers(self, now):
+        while self._timers and self._timers[0][0] <= now:
+            _, _, session_id, retry = heapq.heappop(self._timers)
+            if retry is not None:
+                self._pool.submit(self._deliver, *retry)
+            else:
+                self._ready.append(session_id)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    self._due_timers(time.time())
+                    if self._ready or (self._closed and not self._timers):
+                        break
+                    self._lock.wait(self._timers[0][0] - time.time() if self._timers else None)
+                if not self._ready:
+                    return
+
+                # waiting a bit for more messages
+                deadline = time.time() + self.batch_wait
+                while sum(len(self._queues[s]) for s in self._ready) < self.batch_size and not self._closed:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        break
+                    self._lock.wait(left)
+                    self._due_timers(time.time())
+
+                batch, sessions = [], []
+                while self._ready and len(batch) < self.batch_size:
+                    session_id = self._ready.popleft()
+                    self._scheduled.discard(session_id)
+                    self._busy.add(session_id)
+                    sessions.append(session_id)
+                    batch += [(session_id, message) for message in self._take(session_id)]
+
+            try:
+                requests = self.to_requests(batch)
+            except Exception as e:
+                logging.error('sink: %d messages are dropped, to_requests failed (%r)' % (len(batch), e))
+                self._done(sessions, [], 0, dropped=1)
+                continue
+            self._pool.submit(self._deliver, sessions, requests, 0, len(batch))
+
+    def _connection(self, url):
+        # connections are kept per thread and host
+        parts = urlsplit(url)
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (parts.scheme, parts.netloc)
+        if key not in connections:
+            connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            connections[key] = connection_class(parts.netloc, timeout=self.timeout)
+        return key, connections[key], parts.path + ('?' + parts.query if parts.query else '')
+
+    def _post(self, url, body):
+        """True if delivered, False if it is worth retrying (errors of the request itself are raised)"""
+        data = json.dumps(body)
+        key, connection, path = self._connection(url)
+        try:
+            connection.request('POST', path, data, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning('sink: %s failed (%r)' % (url, e))
+            connection.close()
+            del self._local.connections[key]
+            return False
+
+        if response.status == 429 or response.status >= 500:
+            logging.warning('sink: %s answered %d' % (url, response.status))
+            return False
+        if response.status >= 400:
+            logging.error('sink: %s rejected the messages (%d)' % (url, response.status))
+        return True
+
+    def _deliver(self, sessions, requests, attempt, n_messages=0):
+        # requests go in order, at the first failure the rest waits with it (messages of a session stay in order)
+        sent, dropped, unsent = 0, 0, []
+        for i, (url, body) in enumerate(requests):
+            sent += 1
+            try:
+                if not self._post(url, body):
+                    unsent = requests[i:]
+                    break
+            except Exception as e:
+                # not worth retrying, e.g. messages can't be serialized
+                logging.error('sink: request to %s is dropped (%r)' % (url, e))
+                dropped += 1
+
+        with self._lock:
+            self._counts['requests'] += sent
+            self._counts['messages'] += n_messages
+            if attempt:
+                self._retrying -= 1
+        self._done(sessions, unsent, attempt, dropped)
+
+    def _done(self, sessions, unsent, attempt, dropped=0):
+        """unsent requests (the failed one and those after it) are retried, otherwise the sessions go on"""
+        with self._lock:
+            self._counts['failed'] += dropped
+            if unsent and attempt < self.retries:
+                # the sessions wait (messages stay in order)
+                self._counts['retries'] += 1
+                self._retrying += 1
+                heapq.heappush(self._timers, (time.time() + self.backoff * 2 ** attempt, next(self._order), None,
+                                              (sessions, unsent, attempt + 1)))
+            else:
+                if unsent:
+                    self._counts['failed'] += len(unsent)
+                    logging.error('sink: %d requests are dropped after %d retries' % (len(unsent), attempt))
+                for session_id in sessions:
+                    self._busy.discard(session_id)
+                    self._schedule(session_id)
+            self._lock.notify_all()
+
+    def flush(self, timeout=None):
+        """waits until all messages are delivered (or dropped), False on timeout"""
+        with self._lock:
+            return self._lock.wait_for(lambda: not (self._queues or self._busy or self._retrying), timeout)
+
+    def close(self, timeout=None):
+        """delivers what is left and stops"""
+        self.flush(timeout)
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._thread.join()
+        self._pool.shutdown()
+
+    def info(self):
+        with self._lock:
+            return dict(pending=sum(len(q) for q in self._queues.values()), busy=len(self._busy), **self._counts)
@@ -3,11 +3,16 @@ Contains bot CLI and UI.
 
 author: Deniss Stepanovs
 """
-try:
-    import flask
-    from .app import app
-except:
-    print('For UI support you need to have flask (just run "pip install flask")')
+from ..sessions import BotSessions, DEFAULT_SESSION
+
+
+def _flask_app():
+    # flask is needed only for the UI (botium.server.BotServer has no dependencies)
+    try:
+        from .app import app
+    except ImportError:
+        raise ImportError('For UI support you need to have flask (just run "pip install flask")')
+    return app
 
 
 def bot_cli(bot):
@@ -33,5 +38,18 @@ def bot_cli(bot):
 
 
 def bot_ui(bot, host="127.0.0.1", port=8008):
-    app.bot = bot
-    app.run(debug=False, host=host, port=port)
+    # the given bot serves the default session, other sessions get bots like it
+    sessions = BotSessions.from_bot(bot)
+    sessions.add(DEFAULT_SESSION, bot)
+    bot_gateway(sessions, host=host, port=port)
+
+
+def bot_gateway(sessions, host="127.0.0.1", port=8008):
+    """
+    Serves bots of many sessions (one bot per session), requests are handled in parallel threads.
+
+    :param sessions: botium.sessions.BotSessions (with hooks loading and saving the states)
+    """
+    app = _flask_app()
+    app.sessions = sessions
+    app.run(debug=False, host=host, port=port, threaded=True)
@@ -1,14 +1,37 @@
 """
-Bot simple UI.
+Bot simple UI and multi-session gateway.
+
+Each request is routed by its session id (json "session_id", header "X-Session-Id" or query argument "session_id")
+to a bot of this session, see botium.sessions.BotSessions (app.sessions) for loading/saving the states.
+Besides session id, only message fields (text, image, voice, video) are accepted, anything else answers 400.
 
 author: Deniss Stepanovs
 """
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, render_template
 
+import json
 import sys
 import traceback
 
+from ..sessions import DEFAULT_SESSION, message_kwargs, session_id_of as json_session_id
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
+# set by bot_ui / bot_gateway
+app.sessions = None
+
+ERROR_MESSAGE = {'text': "Unfortunately, API suddenly terminated it's existence"}
+
+
+def session_id_of(data_in):
+    # ValueError for items that are not json objects and for json ids other than str or int
+    json_session_id(data_in)
+    return (data_in.get('session_id') or request.headers.get('X-Session-Id') or request.args.get('session_id')
+            or DEFAULT_SESSION)
+
+
+def json_response(obj, status=200):
+    # serialized once, straight into the response
+    return app.response_class(json.dumps(obj), status=status, mimetype='application/json')
 
 
 @app.route('/', methods=['GET'])
@@ -18,16 +41,42 @@ def index():
 
 @app.route('/api', methods=['POST'])
 def gate_in():
+    data_in = request.get_json()
     try:
-        data_in = request.get_json()
-        text = data_in.get('text')
+        kwargs = message_kwargs(data_in)
+        session_id = session_id_of(data_in)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
 
-        app.bot.reply(text=text)
-        messages = app.bot.mouth.pop_dicts()
-        messages = {'messages': messages}
+    try:
+        messages = app.sessions.reply(session_id, **kwargs)
 
     except:
         traceback.print_exc(file=sys.stdout)
-        messages = {"messages": [{'text': "Unfortunately, API suddenly terminated it's existence"}]}
+        messages = [ERROR_MESSAGE]
+
+    return json_response({'messages': messages})
+
+
+@app.route('/api/batch', methods=['POST'])
+def gate_in_batch():
+    """{"messages": [{"session_id": .., "text": ..}, ..]} -> {"results": [{"session_id": .., "messages": [..]}, ..]}"""
+    try:
+        items = [(session_id_of(data_in), message_kwargs(data_in)) for data_in in request.get_json()['messages']]
+    except (ValueError, KeyError, TypeError) as e:
+        return json_response({'error': 'invalid messages (%s)' % e}, status=400)
+
+    try:
+        replies = app.sessions.reply_batch(items)
+
+    except:
+        traceback.print_exc(file=sys.stdout)
+        return json_response({'results': [], 'messages': [ERROR_MESSAGE]})
+
+    return json_response({'results': [{'session_id': session_id, 'messages': messages}
+                                      for (session_id, _), messages in zip(items, replies)]})
+
 
-    return jsonify(**messages)
+@app.route('/api/info', methods=['GET'])
+def info():
+    return json_response(app.sessions.info())
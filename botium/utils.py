@@ -3,11 +3,14 @@ Contains useful (and less useful) utils.
 
 author: Deniss Stepanovs
 """
-from functools import reduce
+from functools import reduce, lru_cache
+from collections import OrderedDict, deque
+import threading
 import time
 import re
 import random
 import inspect
+import asyncio
 import uuid
 import logging
 
@@ -41,6 +44,21 @@ class classproperty(object):
         return self.fget(owner_cls)
 
 
+class lazyproperty(object):
+    """computed on the first access, then kept in the instance"""
+
+    def __init__(self, fget):
+        self.fget = fget
+        self.name = fget.__name__
+
+    def __get__(self, owner_self, owner_cls):
+        if owner_self is None:
+            return self
+        value = self.fget(owner_self)
+        owner_self.__dict__[self.name] = value
+        return value
+
+
 def current_time():
     return int(1000 * time.time())
 
@@ -55,12 +73,43 @@ def list_of(obj, keep_none=False):
         return [obj]
 
 
+def run_sync(obj):
+    """Waits for awaitable (e.g. async intent used by the sync Bot API), other objects are returned as they are"""
+    if not inspect.isawaitable(obj):
+        return obj
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        async def wait():
+            return await obj
+
+        return asyncio.run(wait())
+
+    if inspect.iscoroutine(obj):
+        obj.close()
+    raise RuntimeError('cannot wait for %s inside a running event loop, use the async API (e.g. Bot.areply)' % obj)
+
+
+async def run_async(obj):
+    """Awaits obj if it is awaitable"""
+    if inspect.isawaitable(obj):
+        return await obj
+    return obj
+
+
 def is_subclass_of(small, big):
     # NB! will be false for the sama classes (Ask is not sublacc of Ask)
     intersection = set(inspect.getmro(small)[1:]).intersection(set([big]))
     return bool(intersection)
 
 
+@lru_cache(maxsize=1024)
+def relative_names(klass):
+    """names of the class and its parents (the same as in is_relative_to)"""
+    return tuple(c.__name__ for c in inspect.getmro(klass) if c not in {dict, list, str, object})
+
+
 def is_relative_to(klass, relative):
     klass = klass.__class__ if type(klass) != type else klass
     if type(relative) == str:
@@ -75,6 +124,7 @@ def is_relative_to(klass, relative):
 hash_text_regex_sub = re.compile(r"[^\w ]|_")
 
 
+@lru_cache(maxsize=4096)
 def hash_text(text):
     text = text.lower()
     text = hash_text_regex_sub.sub('', text)
@@ -83,6 +133,252 @@ def hash_text(text):
     return text
 
 
+words_regex = re.compile(r"\w+")
+
+
+class TextFeatures:
+    """
+    Normalized forms of a text, each computed once on demand.
+
+    Examples
+    --------
+    >>> features = TextFeatures(' Hello   World ')
+    >>> features.lower, features.clean, features.tokens
+    (' hello   world ', 'hello world', ['hello', 'world'])
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._ngrams = {}
+
+    @lazyproperty
+    def lower(self):
+        return self.text.lower()
+
+    @lazyproperty
+    def clean(self):
+        """lowercased with collapsed whitespaces"""
+        return " ".join(self.lower.split())
+
+    @lazyproperty
+    def tokens(self):
+        return self.clean.split()
+
+    @lazyproperty
+    def words(self):
+        """lowercased words without punctuation"""
+        return words_regex.findall(self.lower)
+
+    @lazyproperty
+    def hash(self):
+        return hash_text(self.text)
+
+    def ngrams(self, n=3):
+        """character n-grams of the padded clean text"""
+        if n not in self._ngrams:
+            text = ' %s ' % self.clean
+            self._ngrams[n] = [text[i:i + n] for i in range(len(text) - n + 1)]
+        return self._ngrams[n]
+
+
+def is_ascii(text):
+    return len(text) == len(text.encode())
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds all occurrences of many keywords in a single pass over the text.
+    Keywords and text may be any sequences, e.g. tuples of words and a list of words.
+
+    Examples
+    --------
+    >>> list(AhoCorasick(['he', 'she']).finditer('ushe'))
+    [(1, 4, 1), (2, 4, 0)]
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # trie: transitions, failure links and outputs (keyword ids) per state
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for i, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append(i)
+
+        # failure links (breadth-first)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def finditer(self, text):
+        """yields (start, end, keyword id) for every (possibly overlapping) occurrence"""
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for i in out[state]:
+                yield end - len(keywords[i]), end, i
+
+
+class MultiPattern:
+    """
+    Finds the first (in the given order) of several compiled regexes that matches a text.
+
+    Patterns are matched by one regex call: a combined alternation tries them in order, each one
+    scanning the text through a lazy prefix. Big sets of plain keywords like re.compile('(yes)')
+    go through the AhoCorasick automaton, a real single pass.
+    The winner is matched once more at its position, so the result is the very same match object
+    the pattern's own .search() would return.
+    """
+
+    # plain keyword: one group with no special characters inside
+    _literal_regex = re.compile(r'^\(([^\\.^$*+?{}\[\]|()]+)\)$')
+    # numbered backreferences (broken by group renumbering) and global inline flags can't be combined
+    _uncombinable_regex = re.compile(r'\\[1-9]|\(\?\(\d|\(\?[aiLmsux]+\)')
+
+    # the automaton pays off only for big keyword sets
+    automaton_min_size = 32
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._combined = None
+        self._automaton = None
+
+        flags = set(p.flags for p in self.patterns)
+        flags = flags.pop() if len(flags) == 1 else None
+        if flags is None or flags & re.VERBOSE or \
+                any(self._uncombinable_regex.search(p.pattern) for p in self.patterns):
+            # falling back to one by one search
+            return
+
+        literals = [self._literal_regex.findall(p.pattern) for p in self.patterns]
+        ignore_case = bool(flags & re.IGNORECASE)
+        if len(self.patterns) >= self.automaton_min_size and all(literals) \
+                and not flags & ~(re.IGNORECASE | re.UNICODE) \
+                and (not ignore_case or all(is_ascii(l[0]) for l in literals)):
+            keywords = [l[0].lower() if ignore_case else l[0] for l in literals]
+            self._automaton = AhoCorasick(keywords)
+            self._ignore_case = ignore_case
+            return
+
+        # lazy prefix keeps the order: alternative i is tried on the whole text before i+1
+        combined = '|'.join(r'[\s\S]*?(?P<_option_%d>%s)' % (i, p.pattern) for i, p in enumerate(self.patterns))
+        try:
+            self._combined = re.compile(combined, flags)
+        except (re.error, OverflowError, AssertionError):
+            self._combined = None
+
+    def search(self, text):
+        """text -> (index of the first matching pattern, its match) or (None, None)"""
+        if self._automaton is not None:
+            # case folding of non-ascii texts is left to the regexes
+            if not self._ignore_case or is_ascii(text):
+                first = {}
+                for start, end, i in self._automaton.finditer(text.lower() if self._ignore_case else text):
+                    if i not in first:
+                        first[i] = start
+                if first:
+                    i = min(first)
+                    return i, self.patterns[i].match(text, first[i])
+                return None, None
+
+        elif self._combined is not None:
+            m = self._combined.match(text)
+            if m:
+                i = int(m.lastgroup.rsplit('_', 1)[1])
+                return i, self.patterns[i].match(text, m.start(m.lastgroup))
+            return None, None
+
+        for i, pattern in enumerate(self.patterns):
+            m = pattern.search(text)
+            if m:
+                return i, m
+        return None, None
+
+
+@lru_cache(maxsize=256)
+def multi_pattern(patterns):
+    """cached MultiPattern for a tuple of compiled regexes"""
+    return MultiPattern(patterns)
+
+
+class LRUCache:
+    """
+    Bounded thread-safe cache: the least recently used items are dropped first. Keeps hit/miss counts.
+
+    :param maxsize: max number of items (0 - nothing is cached)
+    :param ttl: seconds an item lives (None - forever)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                set_time, value = self._data[key]
+                if self.ttl is None or time.time() - set_time < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if not self.maxsize or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        n = self.hits + self.misses
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self._data),
+                    maxsize=self.maxsize,
+                    ttl=self.ttl,
+                    hit_rate=self.hits / n if n else 0.)
+
+
 def choose_text(obj):
     """randomly selecting text, if choice is present"""
 
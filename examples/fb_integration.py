@@ -10,12 +10,11 @@ We will use a Flask as a server.
 author: Deniss Stepanovs
 """
 import json
-import requests
 import sqlite3
 from flask import Flask, request
-from threading import Thread
-
 from botium import Bot
+from botium.dispatcher import Dispatcher
+from botium.sinks import HttpSink
 from botium.intents import Echo, Grapher, NonText
 
 
@@ -46,6 +45,26 @@ db.commit()
 db.close()
 
 
+def to_fb_requests(batch):
+    # Send API takes one message per request (the sink posts them over kept-alive connections)
+    requests = []
+    for sender_id, response in batch:
+        # options -> quick_replies
+        if 'options' in response:
+            response['quick_replies'] = [{"content_type": "text", 'title': opt, "payload": opt} for opt in
+                                         response.pop('options')]
+        # serializing
+        message = dict(message={k: v for k, v in response.items() if k in {'text', 'quick_replies'}},
+                       recipient={'id': sender_id},
+                       messaging_type="RESPONSE")
+        requests.append((POST_URL, message))
+    return requests
+
+
+# bot's messages are posted to FB in the background: delays are kept, failed posts are retried
+sink = HttpSink(to_requests=to_fb_requests)
+
+
 # main message for replying
 def reply(sender_id, message_text):
     # connecting to the database (where states are stored)
@@ -58,33 +77,21 @@ def reply(sender_id, message_text):
     # restoring bot's state from Text
     state = json.loads(rows[0][0]) if rows else {}
 
-    # creating a bot with a given initial state
-    bot = EchoBot(state=state)
+    # creating a bot with a given initial state, its replies go to the sink
+    bot = EchoBot(state=state, sink=sink.session(sender_id))
     # bot replies
-    bot.reply(message_text)
-    # popping all replies
-    responses = bot.mouth.pop_dicts()
+    bot.reply(text=message_text)
     # dumping bot's state
     bot_state_json = json.dumps(bot.state)
     cursor.execute('INSERT OR REPLACE INTO states VALUES(?,?)', (sender_id, bot_state_json))
     db.commit()
     db.close()
 
-    # posting bot replies to FB
-    for response in responses:
-        # options -> quick_replies
-        if 'options' in response:
-            response['quick_replies'] = [{"content_type": "text", 'title': opt, "payload": opt} for opt in
-                                         response.pop('options')]
-        # serializing
-        message = dict(message={k: v for k, v in response.items() if k in {'text', 'quick_replies'}},
-                       recipient={'id': sender_id},
-                       messaging_type="RESPONSE")
-
-        r = requests.post(POST_URL, json=message)
-
 
 app = Flask(__name__)
+# messages of a user are replied one by one (in order), different users in parallel;
+# if too many messages are waiting, the webhook waits a bit and then fails (facebook will resend)
+dispatcher = Dispatcher(workers=8, max_pending=1000)
 
 
 @app.route('/api', methods=['GET'])
@@ -113,12 +120,17 @@ def gate_in():
                     message_text = message['message'].get('text')
 
                     if sender_id and message_text:
-                        # running the bot in separate thread ( so facebook is always happy)
-                        t = Thread(target=reply, args=(sender_id, message_text,))
-                        t.start()
+                        # replying in worker threads (so facebook is always happy)
+                        dispatcher.submit(sender_id, reply, sender_id, message_text, timeout=5)
 
     return 'all good'
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    # queue depths of the dispatcher
+    return json.dumps(dispatcher.stats())
+
+
 if __name__ == '__main__':
     app.run(port=8000, debug=True)
@@ -0,0 +1,40 @@
+"""
+This is a comparison of the built-in TfidfNlp (numpy only) and SpacySklearnNlp (spacy vectors + sklearn).
+
+Accuracy is estimated leaving one example out, latency is measured per single prediction.
+Spacy part is skipped if spacy (or its model) is not available.
+"""
+import time
+from botium.nlp import NlpData, TfidfNlp, SpacySklearnNlp
+
+data = NlpData(r"./examples/data/rasa_dataset.md").data
+
+
+def best_intent(nlp, text):
+    return max(nlp(text)['intents'], key=lambda d: d['confidence'])['intent']
+
+
+def benchmark(make_nlp, name, repeat=1000):
+    # leave-one-out accuracy
+    correct = 0
+    for i, example in enumerate(data):
+        nlp = make_nlp(data[:i] + data[i + 1:])
+        correct += best_intent(nlp, example['text']) == example['intent']
+
+    # latency (caching is switched off)
+    nlp = make_nlp(data)
+    nlp.cache_size = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        nlp('show me a mexican place in the centre')
+    latency = (time.perf_counter() - start) / repeat
+
+    print('%s: accuracy %.2f, %.3f ms per prediction' % (name, correct / len(data), 1000 * latency))
+
+
+benchmark(TfidfNlp, 'TfidfNlp')
+
+try:
+    benchmark(lambda d: SpacySklearnNlp(d, lang='en'), 'SpacySklearnNlp', repeat=100)
+except (ImportError, OSError) as e:
+    print('SpacySklearnNlp: skipped (%s)' % e)
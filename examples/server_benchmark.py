@@ -0,0 +1,79 @@
+"""
+This is a local load test of BotServer (asyncio, standard library only) and the Flask app (botium.ui.app).
+
+Clients keep their connections open (keep-alive) and send requests of their own session,
+optionally several at once (pipelining). Flask part is skipped if flask is not installed.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from botium import Bot
+from botium.intents import Echo
+from botium.sessions import BotSessions
+from botium.server import BotServer
+
+CLIENTS = 32
+REQUESTS = 200
+PIPELINE = 4
+
+
+class EchoBot(Bot):
+    intents = [Echo]
+
+
+def request(session_id, i):
+    body = json.dumps({'session_id': session_id, 'text': 'hello %d' % i}).encode()
+    return (b'POST /api HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            b'Content-Length: %d\r\n\r\n' % len(body)) + body
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int([line for line in head.split(b'\r\n') if line.lower().startswith(b'content-length')][0].split(b':')[1])
+    body = await reader.readexactly(length)
+    assert head.startswith(b'HTTP/1.1 200'), head
+    return json.loads(body)
+
+
+async def client(port, session_id, pipeline):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for start in range(0, REQUESTS, pipeline):
+        writer.write(b''.join(request(session_id, i) for i in range(start, min(start + pipeline, REQUESTS))))
+        for i in range(start, min(start + pipeline, REQUESTS)):
+            response = await read_response(reader)
+            assert response['messages'][0]['text'] == 'ECHO: hello %d.' % i
+    writer.close()
+
+
+async def load(port, pipeline):
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, 'user-%d' % c, pipeline) for c in range(CLIENTS)])
+    return CLIENTS * REQUESTS / (time.perf_counter() - start)
+
+
+def run_in_thread(target):
+    threading.Thread(target=target, daemon=True).start()
+    time.sleep(0.5)
+
+
+def benchmark(name, port):
+    for pipeline in (1, PIPELINE):
+        print('%s, pipeline %d: %.0f requests/s' % (name, pipeline, asyncio.run(load(port, pipeline))))
+
+
+sessions = BotSessions(EchoBot)
+server = BotServer(sessions, workers=8)
+run_in_thread(lambda: asyncio.run(server.serve_forever(port=8018)))
+benchmark('BotServer', 8018)
+
+try:
+    from werkzeug.serving import make_server
+    from botium.ui.app import app
+
+    app.sessions = BotSessions(EchoBot)
+    run_in_thread(make_server('127.0.0.1', 8019, app, threaded=True).serve_forever)
+    benchmark('Flask (threaded)', 8019)
+except ImportError:
+    print('Flask part is skipped (no flask)')
@@ -4,6 +4,7 @@ Many tests, high coverage, but a bit messy.
 author: Deniss Stepanovs
 """
 from time import sleep
+import threading
 import unittest
 from botium import *
 from botium.entities import *
@@ -14,6 +15,10 @@ from botium.intents import *
 from botium.bots import TestBot
 from botium.conditions import *
 from botium.nlp import TestNlp
+from botium.sessions import BotSessions, SqliteStore, message_kwargs, session_id_of
+from botium.server import BotServer
+from botium.scheduler import Scheduler
+from botium.sinks import HttpSink
 
 config.SHOW_WELCOME_MESSAGE = False
 
@@ -606,6 +611,81 @@ class botiumTest(unittest.TestCase):
         bot.check()
         self.assertTrue(len(bot.mouth) == 3)
 
+    def test_scheduler(self):
+        scheduler = Scheduler()
+        scheduler.schedule('a', 30)
+        scheduler.schedule('b', 10)
+        scheduler.schedule('a', 20)
+        scheduler.schedule('c', 5)
+        scheduler.schedule('c', None)
+        self.assertTrue(scheduler.pop_due(now=15) == ['b'])
+        self.assertTrue(scheduler.pop_due(now=25) == ['a'])
+        self.assertTrue(len(scheduler) == 0 and scheduler.pop_due(now=100) == [])
+
+        # only bots with time triggers are scheduled, repeating triggers are rescheduled
+        sessions = BotSessions(scheduler=scheduler)
+        now = current_time()
+        with sessions.session('interval') as bot:
+            bot.do(actions=SetTrigger(trigger=Trigger(actions=Say(text='tick'), n=2,
+                                                      condition=IntervalCondition(interval=60000))))
+        with sessions.session('time') as bot:
+            bot.do(actions=SetTrigger(trigger=Trigger(actions=Say(text='now'), condition=TimeCondition(time=now))))
+        sessions.reply('none', text='hi')
+        self.assertTrue(len(scheduler) == 2 and scheduler.due_time('none') is None)
+        self.assertTrue(scheduler.due_time('time') == now and scheduler.due_time('interval') >= now + 60000)
+
+        said = []
+        for session_id in scheduler.pop_due(now=now):
+            said += [m['text'] for m in sessions.check(session_id)]
+        self.assertTrue(said == ['Now.'] and len(scheduler) == 1)
+        due_time = scheduler.due_time('interval')
+        self.assertTrue(scheduler.pop_due(now=due_time - 1) == [] and scheduler.pop_due(now=due_time) == ['interval'])
+
+        # the thread wakes due sessions, failed ones are retried later (not lost)
+        scheduler = Scheduler(backoff=100, max_backoff=1000)
+        woken = threading.Event()
+
+        def callback(session_id):
+            woken.set()
+            raise ValueError(session_id)
+
+        scheduler.schedule('bad', 0)
+        scheduler.start(callback)
+        self.assertTrue(woken.wait(5))
+        scheduler.stop()
+        self.assertTrue(scheduler.info()['woken'] == 1 and scheduler.info()['failed'] == 1)
+        self.assertTrue(scheduler.due_time('bad') >= current_time() + 90000)
+        scheduler.retry('bad')
+        self.assertTrue(scheduler.due_time('bad') >= current_time() + 190000)
+
+    def test_sessions_sweep(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        store = SqliteStore(':memory:')
+        sessions = BotSessions(store=store, maxsize=2)
+        now = current_time()
+        for i in range(20):
+            with sessions.session('user-%d' % i) as bot:
+                if i % 4 == 0:
+                    bot.do(actions=SetTrigger(trigger=Trigger(actions=Say(text='remind %d' % i),
+                                                              condition=TimeCondition(time=now - 100 + 10 * i))))
+        self.assertTrue(store.due(now) == ['user-0', 'user-4', 'user-8'])
+
+        # only due sessions are loaded, only changed are saved
+        loaded, saved = [], []
+        load_many, save_many = store.load_many, store.save_many
+        store.load_many = lambda session_ids: loaded.extend(session_ids) or load_many(session_ids)
+        store.save_many = lambda items: saved.extend(item[0] for item in items) or save_many(items)
+
+        said = sessions.sweep(batch_size=2, executor=ThreadPoolExecutor(2))
+        self.assertTrue([(s, m[0]['text']) for s, m in said] == [('user-%d' % i, 'Remind %d.' % i) for i in (0, 4, 8)])
+        self.assertTrue(loaded == saved == ['user-0', 'user-4', 'user-8'])
+        self.assertTrue(store.due(now) == [] and store.due(now + 1000) == ['user-12', 'user-16'])
+
+        # the state is saved
+        with sessions.session('user-4') as bot:
+            self.assertTrue(bot.due_time() is None and len(bot.triggers) == 0)
+
     # ===== #
     # AREAS #
     # ===== #
@@ -664,6 +744,61 @@ class botiumTest(unittest.TestCase):
 
         config.SHOW_WELCOME_MESSAGE = False
 
+    def test_config_per_bot(self):
+        from threading import Thread
+
+        welcome = config.MESSAGE_WELCOME
+        bots = [TestBot(SHOW_WELCOME_MESSAGE=True, MESSAGE_WELCOME='hi %d' % i) for i in range(8)]
+        # the global config is not changed
+        self.assertTrue(config.MESSAGE_WELCOME == welcome and not config.SHOW_WELCOME_MESSAGE)
+        self.assertRaises(AttributeError, setattr, bots[0].config, 'WPM', 1)
+
+        def chat(bot):
+            for _ in range(20):
+                bot.reply(text='any')
+
+        threads = [Thread(target=chat, args=(bot,)) for bot in bots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i, bot in enumerate(bots):
+            self.assertTrue(bot.mouth[0].text == 'Hi %d.' % i)
+
+        # bots without overrides follow the global config
+        bot = TestBot()
+        self.assertTrue(bot.config is config)
+
+        # defaults of actions are taken when the bot says them
+        bot = TestBot(MESSAGE_CONFIRM='sure?')
+        bot.do(actions=Confirm(yes=Say(text='ok')))
+        self.assertTrue(bot.mouth[0].text == 'Sure?')
+
+        # the shared matcher cache keeps the global size
+        size = Matcher._cache.maxsize
+        bot = TestBot(MATCH_CACHE_SIZE=1)
+        bot.do(actions=Ask(text='ready?', options=['yes', 'no']))
+        bot.reply(text='yes')
+        self.assertTrue(Matcher._cache.maxsize == size == config.MATCH_CACHE_SIZE)
+
+        # incoming messages are created (validated) with the bot's config
+        import asyncio
+        from unittest import mock
+        from botium.config import current_config
+
+        configs = []
+
+        def message(**kwargs):
+            configs.append(current_config())
+            return Message(**kwargs)
+
+        bot = TestBot(MODE='test')
+        with mock.patch('botium.bots.Message', message):
+            bot.reply(text='hi')
+            asyncio.run(bot.areply(text='hi'))
+            Bot.reply_batch([(bot, dict(text='hi'))])
+        self.assertTrue(len(configs) == 3 and all(c is bot.config for c in configs))
+
     def test_ask_config(self):
         # no clarification
         config.RESPONSE_CLARIFY = False
@@ -701,6 +836,279 @@ class botiumTest(unittest.TestCase):
         self.assertTrue(len(bot.mouth) == 4)
         self.assertTrue(is_empty(bot.state, but={'Memory'}))
 
+    def test_bot_reply_batch(self):
+        class CountingNlp(TestNlp):
+            batches = []
+
+            def predict_batch(self, texts):
+                self.batches.append(texts)
+                return super().predict_batch(texts)
+
+        nlp = CountingNlp()
+        bots = [Bot(nlp=nlp) for _ in range(3)]
+        for bot in bots:
+            bot.do(actions=Ask(text='where are you from?', options=NamedEntity(name='location')))
+
+        Bot.reply_batch([(bots[0], dict(text='i am from riga')),
+                         (bots[1], dict(text='i am from heidelberg')),
+                         (bots[2], dict(text='from latvia')),
+                         (Bot(), dict(text='hi'))])
+
+        # one batch for all messages of the engine
+        self.assertTrue(nlp.batches == [['i am from riga', 'i am from heidelberg', 'from latvia']])
+        for bot in bots:
+            self.assertTrue(is_empty(bot.state, but={'Memory'}))
+        self.assertTrue(bots[1].memory['general'].popitem()[1]['match'] == 'heidelberg')
+
+        # batch gives the same as one by one
+        texts = ['i am from riga', 'my name is bob']
+        self.assertTrue(nlp.batch(texts) == [nlp(text) for text in texts])
+
+    def test_bot_areply(self):
+        import asyncio
+
+        class Lookup(Intent):
+            async def score(self, message, **kwargs):
+                await asyncio.sleep(0.01)
+                return int('weather' in message.text)
+
+            async def __call__(self, *args, **kwargs):
+                await asyncio.sleep(0.01)
+                return Say(text='sunny')
+
+        class AsyncNlp(TestNlp):
+            async def apredict(self, text):
+                await asyncio.sleep(0.01)
+                return self.predict(text)
+
+        async def chat(bot, texts):
+            for text in texts:
+                await bot.areply(text=text)
+
+        async def chats(bots):
+            await asyncio.gather(*[chat(bot, ['weather?', 'hi']) for bot in bots])
+
+        bots = [Bot(intents=[Lookup, Echo], nlp=AsyncNlp()) for _ in range(50)]
+        start = current_time()
+        asyncio.run(chats(bots))
+        # conversations don't wait for each other
+        self.assertTrue(current_time() - start < 1000)
+        for bot in bots:
+            self.assertTrue([say.text for say in bot.mouth] == ['Sunny.', 'ECHO: hi.'])
+
+        # async ask with named entities
+        bot = Bot(nlp=AsyncNlp())
+        bot.do(actions=Ask(text='where are you from?', options=NamedEntity(name='location')))
+        asyncio.run(bot.areply(text='i am from riga'))
+        self.assertTrue(bot.memory['general'].popitem()[1]['match'] == 'riga')
+
+        # the sync API works with async intents too
+        bot = Bot(intents=[Lookup, Echo])
+        bot.reply(text='weather today?')
+        self.assertTrue(bot.mouth[0].text == 'Sunny.')
+
+    def test_bot_sessions(self):
+        from threading import Thread
+
+        sessions = BotSessions(lambda state: Bot(state=state, intents=[Echo]), maxsize=3)
+        replies = {}
+
+        def chat(session_id):
+            replies[session_id] = [sessions.reply(session_id, text='%s %d' % (session_id, i))[0]['text']
+                                   for i in range(5)]
+
+        # bots are dropped from memory and restored from their states on the way
+        threads = [Thread(target=chat, args=(session_id,)) for session_id in 'abcdefgh']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for session_id in 'abcdefgh':
+            self.assertTrue(replies[session_id] == ['ECHO: %s %d.' % (session_id, i) for i in range(5)])
+            with sessions.session(session_id) as bot:
+                self.assertTrue(len(bot._areas['Events'].log) == 10)
+        self.assertTrue(sessions.info()['size'] == 3 and sessions.info()['in_use'] == 0)
+
+        # batch: in order per session
+        results = sessions.reply_batch([('a', dict(text='x')), ('b', dict(text='y')), ('a', dict(text='z'))])
+        self.assertTrue([r[0]['text'] for r in results] == ['ECHO: x.', 'ECHO: y.', 'ECHO: z.'])
+
+        # only message fields come from requests
+        self.assertTrue(message_kwargs(dict(session_id='a', text='hi')) == dict(text='hi'))
+        for data in [dict(text='hi', _nlp='engine'), dict(_entities=[]), dict(text=1), ['hi']]:
+            self.assertRaises(ValueError, message_kwargs, data)
+        # session ids: strings and integers of json objects
+        self.assertTrue(session_id_of(dict(session_id=7)) == 7 and session_id_of({}) == 'default')
+        for data in [dict(session_id=['a']), dict(session_id={}), 'hi']:
+            self.assertRaises(ValueError, session_id_of, data)
+
+    def test_bot_server(self):
+        import asyncio
+        import json
+
+        def post(path, obj):
+            body = json.dumps(obj).encode()
+            return b'POST %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (path.encode(), len(body), body)
+
+        async def read(reader):
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+            return int(head.split()[1]), json.loads(await reader.readexactly(length))
+
+        async def run():
+            server = BotServer(BotSessions(lambda state: Bot(state=state, intents=[Echo])), workers=2)
+            port = (await server.start(port=0)).sockets[0].getsockname()[1]
+
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            # pipelining: all requests are sent at once, responses come in order
+            writer.write(b''.join(post('/api', dict(session_id=s, text='%s %d' % (s, i)))
+                                  for i in range(5) for s in 'ab'))
+            for i in range(5):
+                for s in 'ab':
+                    status, response = await read(reader)
+                    self.assertTrue(status == 200 and response['messages'][0]['text'] == 'ECHO: %s %d.' % (s, i))
+            writer.write(post('/api/batch', dict(messages=[dict(session_id='a', text='x'), dict(text='y')])))
+            status, response = await read(reader)
+            self.assertTrue([r['messages'][0]['text'] for r in response['results']] == ['ECHO: x.', 'ECHO: y.'])
+            writer.write(post('/nothing', {}) + b'GET /api HTTP/1.1\r\n\r\n' + post('/api', {}))
+            self.assertTrue([(await read(reader))[0] for _ in range(3)] == [404, 405, 200])
+            # only message fields are taken from requests
+            writer.write(post('/api', dict(text='hi', _nlp='x')) +
+                         post('/api/batch', dict(messages=[dict(_entities=1)])) +
+                         post('/api/batch', dict(messages=['hi'])) +
+                         post('/api', dict(session_id=['a'], text='hi')) +
+                         post('/api/batch', dict(messages=[dict(session_id={}, text='hi')])))
+            self.assertTrue([(await read(reader))[0] for _ in range(5)] == [400] * 5)
+            # the connection is closed after a broken request
+            writer.write(b'POST /api HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n')
+            self.assertTrue((await read(reader))[0] == 413)
+            self.assertTrue(await reader.read() == b'')
+            writer.close()
+
+            await server.close()
+
+        asyncio.run(run())
+
+    def test_http_sink(self):
+        import json
+        import threading
+        import time
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        received, statuses, clients = [], [], set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                clients.add(self.client_address)
+                # the first request fails, it is retried
+                status = 200 if statuses else 503
+                if status == 200:
+                    received.append((time.time(), body['messages']))
+                statuses.append(status)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        sink = HttpSink('http://127.0.0.1:%d/out' % server.server_address[1], batch_wait=0.05, workers=2,
+                        backoff=0.01)
+
+        # messages of many sessions go in a few requests
+        sessions = BotSessions(lambda state: Bot(state=state, intents=[Echo], PROVIDE_DELAYS=False), sink=sink)
+        for i in range(20):
+            self.assertTrue(sessions.reply('user-%d' % (i % 5), text='hi %d' % i) == [])
+        self.assertTrue(sink.flush(timeout=5))
+        messages = [m for _, batch in received for m in batch]
+        self.assertTrue(len(messages) == 20 and len(received) < 20)
+        for s in range(5):
+            texts = [m['text'] for m in messages if m['session_id'] == 'user-%d' % s]
+            self.assertTrue(texts == ['ECHO: hi %d.' % i for i in range(s, 20, 5)])
+
+        # delays are kept between messages of a session
+        del received[:]
+        sink.send('d', [dict(text='one'), dict(text='two', delay=100)])
+        sink.close(timeout=5)
+        self.assertTrue([batch[0]['text'] for _, batch in received] == ['one', 'two'])
+        self.assertTrue(received[1][0] - received[0][0] >= 0.09)
+
+        info = sink.info()
+        self.assertTrue(info['messages'] == 22 and info['retries'] == 1 and info['failed'] == 0)
+        # connections are reused
+        self.assertTrue(len(clients) <= 3)
+        server.shutdown()
+
+    def test_http_sink_failures(self):
+        import json
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        received, fail_once = [], set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                texts = [m['text'] for m in json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                         ['messages']]
+                status = 503 if fail_once & set(texts) else 200
+                fail_once.difference_update(texts)
+                if status == 200:
+                    received.extend(texts)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d/out' % server.server_address[1]
+
+        # failing hook: the batch is dropped, the sink goes on
+        def to_requests(batch):
+            if any(message['text'] == 'bad' for _, message in batch):
+                raise ValueError('bad')
+            return [(url, {'messages': [message for _, message in batch]})]
+
+        sink = HttpSink(to_requests=to_requests, batch_wait=0)
+        sink.send('a', dict(text='bad'))
+        self.assertTrue(sink.flush(timeout=5))
+        sink.send('a', dict(text='good'))
+        self.assertTrue(sink.flush(timeout=5) and sink._thread.is_alive())
+        self.assertTrue(received == ['good'] and sink.info()['failed'] == 1)
+        sink.close(timeout=5)
+
+        # messages that can't be posted (not json) are dropped, the session goes on
+        del received[:]
+        sink = HttpSink(url, batch_wait=0)
+        sink.send('a', dict(text='not json', options=[object()]))
+        self.assertTrue(sink.flush(timeout=5))
+        sink.send('a', dict(text='json'))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertTrue(received == ['json'] and sink.info()['failed'] == 1 and sink.info()['busy'] == 0)
+        sink.close(timeout=5)
+
+        # a failed request and those after it are retried together, messages of a session stay in order
+        del received[:]
+        fail_once.add('one')
+        sink = HttpSink(to_requests=lambda batch: [(url, {'messages': [message]}) for _, message in batch],
+                        batch_wait=0.05, backoff=0.01)
+        sink.send('a', [dict(text='one'), dict(text='two')])
+        sink.send('b', dict(text='three'))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertTrue(received == ['one', 'two', 'three'])
+        self.assertTrue(sink.info()['retries'] == 1 and sink.info()['failed'] == 0)
+        sink.close(timeout=5)
+        server.shutdown()
+
     def test_bot_check(self):
         bot = Bot()
         time_at = current_time() + 30
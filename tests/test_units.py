@@ -5,6 +5,7 @@ author: Deniss Stepanovs
 """
 import unittest
 from time import sleep
+from contextlib import contextmanager
 
 from botium import *
 from botium.bots import TestBot
@@ -13,7 +14,12 @@ from botium.intents import *
 from botium.utils import *
 from botium.areas import *
 from botium.ui import bot_ui
-from botium.nlp import TestNlp
+from botium.nlp import TestNlp, NlpData, RuleNlp, ProcessPoolNlp
+from botium.dispatcher import Dispatcher
+import threading
+import queue
+import pickle
+import os
 
 from botium.conditions import *
 from botium.intents import Echo, Stop
@@ -25,6 +31,59 @@ import logging
 logging.getLogger().setLevel(logging.WARNING)
 
 
+class StubSpacy:
+    """stand-in for a spacy pipeline (no model can be downloaded in tests): letter counts as vectors"""
+    meta = dict(name='stub', version='0')
+
+    def __init__(self):
+        self.n_texts = 0
+
+    def __call__(self, text):
+        import numpy as np
+        from types import SimpleNamespace
+
+        self.n_texts += 1
+        vector = np.zeros(27)
+        for char in text.lower():
+            vector[ord(char) - ord('a') if 'a' <= char <= 'z' else 26] += 1
+        return SimpleNamespace(vector=vector, ents=[])
+
+    def pipe(self, texts):
+        return [self(text) for text in texts]
+
+    @staticmethod
+    @contextmanager
+    def patched(pipeline):
+        """SpacySklearnNlp created inside gets the pipeline"""
+        import sys
+        from types import SimpleNamespace
+
+        spacy = sys.modules.get('spacy')
+        sys.modules['spacy'] = SimpleNamespace(load=lambda lang: pipeline)
+        try:
+            yield pipeline
+        finally:
+            if spacy is None:
+                del sys.modules['spacy']
+            else:
+                sys.modules['spacy'] = spacy
+
+
+STUB_DATA = [dict(text=text, intent=intent, entities=[]) for intent, texts in [
+    ('greet', ['hello', 'hi there', 'hey hey', 'hello there', 'good morning']),
+    ('bye', ['goodbye', 'see you', 'bye bye', 'see you later', 'farewell'])] for text in texts]
+
+
+class NameIntent(Intent):
+    """reads NLP entities (picklable: for process pools)"""
+
+    def score(self, message, **kwargs):
+        return int(any(entity['entity'] == 'name' for entity in message._entities))
+
+    def __call__(self, *args, **kwargs):
+        return Say(text='named')
+
+
 class botiumUnitTest(unittest.TestCase):
     """testing small units: matchers, entities, utils"""
     TEXT = 'hi'
@@ -152,6 +211,208 @@ class botiumUnitTest(unittest.TestCase):
         self.assertTrue({'entity': 'age', 'value': '32'} in d['entities'])
         '''
 
+    def test_nlp_cache(self):
+        nlp = TestNlp()
+        d = nlp('i am from riga')
+        self.assertTrue(nlp.cache_info()['misses'] == 1)
+
+        # copies are returned
+        d['entities'][0]['value'] = 'changed'
+        self.assertTrue(nlp('i am from riga')['entities'][0]['value'] == 'riga')
+        self.assertTrue(nlp.cache_info()['hits'] == 1)
+
+        # pluggable normalizer
+        nlp = TestNlp()
+        nlp.cache_normalizer = clean_text
+        nlp('i am from riga')
+        nlp(' I am  from RIGA')
+        self.assertTrue(nlp.cache_info()['hits'] == 1)
+
+        # ttl
+        nlp = TestNlp()
+        nlp.cache_ttl = 0.01
+        nlp('hi')
+        sleep(0.02)
+        nlp('hi')
+        self.assertTrue(nlp.cache_info()['hits'] == 0 and nlp.cache_info()['misses'] == 2)
+
+        # no caching
+        nlp = TestNlp()
+        nlp.cache_size = 0
+        nlp('hi')
+        nlp('hi')
+        self.assertTrue(nlp.cache_info()['size'] == 0)
+
+    def test_nlp_rules(self):
+        import tempfile
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('New York\nNew York City\nRiga\n')
+
+        try:
+            nlp = RuleNlp(patterns=[r"age is (?P<age>\d+)", r"(?P<name>bob|alice)"],
+                          gazetteers=dict(city=f.name, name=['Alice', 'Mary Ann']))
+        finally:
+            os.remove(f.name)
+
+        entities = nlp('Alice from new york city, age is 32')['entities']
+        self.assertTrue(dict(entity='age', value='32', start=33, end=35) in entities)
+        self.assertTrue(dict(entity='name', value='Alice', start=0, end=5) in entities)
+        # leftmost-longest value, whole words only
+        self.assertTrue(dict(entity='city', value='new york city', start=11, end=24) in entities)
+        self.assertTrue(not [e for e in entities if e['value'] == 'new york'])
+        self.assertTrue(nlp('Rigasmith')['entities'] == [])
+
+        # no rule matches
+        self.assertTrue(nlp('hello')['entities'] == [])
+        self.assertTrue(TestNlp()._prefilter is not None)
+
+    def test_nlp_process_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        class FailingNlp(TestNlp):
+            def predict(self, text):
+                if text == 'fail':
+                    raise ValueError(text)
+                return super().predict(text)
+
+        texts = ['i am from riga', 'my name is bob'] + ['age is %d' % i for i in range(100)]
+        with ProcessPoolNlp(FailingNlp(), workers=2, batch_size=8) as nlp:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(nlp, texts))
+            self.assertTrue(results == [TestNlp()(text) for text in texts])
+            self.assertTrue(nlp.predict_batch(texts) == [TestNlp().predict(text) for text in texts])
+
+            # errors are raised in the caller, workers keep working
+            self.assertRaises(RuntimeError, nlp, 'fail')
+            self.assertTrue(nlp('my name is alice') == TestNlp()('my name is alice'))
+
+            # texts of the same micro-batch are not failed with it
+            futures = nlp._submit(['my name is bob', 'fail', 'i am from riga'])
+            self.assertRaises(RuntimeError, futures[1].result)
+            self.assertTrue([futures[0].result(), futures[2].result()] ==
+                            [TestNlp().predict('my name is bob'), TestNlp().predict('i am from riga')])
+
+        self.assertRaises(RuntimeError, nlp.predict, 'hi')
+
+    def test_nlp_tfidf(self):
+        try:
+            from botium.nlp import TfidfNlp
+            nlp = TfidfNlp('examples/data/rasa_dataset.md')
+        except ImportError:
+            self.skipTest('numpy is not installed')
+
+        d = nlp('hello there')
+        self.assertTrue({'entities', 'intents'} == set(d))
+        self.assertTrue(d['intents'][0]['intent'] == 'greet')
+        self.assertTrue(abs(sum(x['confidence'] for x in d['intents']) - 1) < 1e-4)
+        self.assertTrue(nlp('i am looking for a mexican restaurant')['intents'][0]['intent'] == 'restaurant_search')
+
+        # unknown words: no preference
+        d = nlp('@@@')
+        self.assertTrue(len(set(round(x['confidence'], 4) for x in d['intents'])) == 1)
+
+    def test_nlp_data_fingerprint(self):
+        data = [dict(text='hi', intent='greet', entities=[])]
+        same_data = [dict(intent='greet', entities=[], text='hi')]
+        self.assertTrue(NlpData.fingerprint(data) == NlpData.fingerprint(same_data))
+        self.assertTrue(NlpData.fingerprint(data) != NlpData.fingerprint(data + data))
+
+        path = TestNlp()._model_path('models', NlpData.fingerprint(data), 'en')
+        self.assertTrue(path.startswith(os.path.join('models', 'TestNlp-')))
+        self.assertTrue(path == TestNlp()._model_path('models', NlpData.fingerprint(data), 'en'))
+
+    def test_nlp_save_load(self):
+        import tempfile
+        from botium.nlp import SpacySklearnNlp
+
+        texts = ['hello you', 'bye now', 'see you there']
+        with tempfile.TemporaryDirectory() as cache_dir, StubSpacy.patched(StubSpacy()):
+            nlp = SpacySklearnNlp(STUB_DATA, cache_dir=cache_dir)
+            predictions = [nlp.predict(text) for text in texts]
+
+            # warm start: the saved model is loaded, not trained
+            spacy = StubSpacy()
+            with StubSpacy.patched(spacy):
+                warm = SpacySklearnNlp(STUB_DATA, cache_dir=cache_dir)
+            self.assertTrue(spacy.n_texts == 0 and warm._clf is not nlp._clf)
+            self.assertTrue([warm.predict(text) for text in texts] == predictions)
+
+            # explicit file
+            filename = os.path.join(cache_dir, 'model.pkl')
+            self.assertTrue(nlp.save(filename))
+            other = SpacySklearnNlp(STUB_DATA[:2] + STUB_DATA[-2:])
+            self.assertTrue(other.load(filename))
+            self.assertTrue([other.predict(text) for text in texts] == predictions)
+            self.assertTrue(not other.load(os.path.join(cache_dir, 'nothing.pkl')))
+
+    def test_nlp_refit(self):
+        import tempfile
+        from sklearn.linear_model import SGDClassifier
+        from botium.nlp import SpacySklearnNlp
+
+        def top(nlp, text):
+            return nlp(text)['intents'][0]['intent']
+
+        thanks = [dict(text=text, intent='thanks', entities=[]) for text in ['thanks', 'thank you', 'many thanks']]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            spacy = StubSpacy()
+            with StubSpacy.patched(spacy):
+                nlp = SpacySklearnNlp(STUB_DATA, cache_dir=cache_dir)
+            self.assertTrue(spacy.n_texts == len(STUB_DATA))
+            self.assertTrue(top(nlp, 'thanks') != 'thanks')
+
+            # new intent: fitted again on cached vectors, spacy runs only for the new texts
+            spacy.n_texts = 0
+            nlp.add_examples(thanks)
+            nlp.refit()
+            self.assertTrue(spacy.n_texts == len(thanks))
+            # cached predictions of the old model are gone
+            self.assertTrue(top(nlp, 'thanks') == 'thanks')
+
+            # vectors are kept in the cache_dir: another engine doesn't need spacy for them
+            spacy = StubSpacy()
+            with StubSpacy.patched(spacy):
+                other = SpacySklearnNlp(STUB_DATA + thanks, cache_dir=cache_dir, clf=SGDClassifier(loss='log_loss'))
+            self.assertTrue(spacy.n_texts == 0)
+
+            # known intents: partial_fit with the new examples only
+            clf = other._clf
+            other('see you soon')
+            spacy.n_texts = 0
+            other.add_examples([dict(text='see you soon', intent='bye', entities=[])])
+            other.refit()
+            self.assertTrue(spacy.n_texts == 1 and other._clf is clf)
+            self.assertTrue(other.cache_info()['size'] == 0)
+
+            # the same examples again: the saved model is loaded
+            spacy = StubSpacy()
+            with StubSpacy.patched(spacy):
+                nlp = SpacySklearnNlp(STUB_DATA, cache_dir=cache_dir)
+            nlp('thanks')
+            spacy.n_texts = 0
+            nlp.add_examples(thanks)
+            nlp.refit()
+            self.assertTrue(spacy.n_texts == 0 and nlp.cache_info()['size'] == 0)
+            self.assertTrue(top(nlp, 'thanks') == 'thanks')
+
+    def test_nlp_data_stream(self):
+        import io, json
+        file_name = 'examples/data/rasa_dataset.md'
+        data = NlpData(file_name).data
+        self.assertTrue(list(NlpData.stream(file_name)) == data)
+        self.assertTrue(NlpData.fingerprint_stream(file_name) == NlpData.fingerprint(data))
+
+        # examples are split between the chunks
+        chunk_size = NlpData.chunk_size
+        NlpData.chunk_size = 7
+        try:
+            rasa = json.dumps(dict(rasa_nlu_data=dict(regex_features=[], common_examples=data)), indent=2)
+            self.assertTrue(list(NlpData.stream(io.StringIO(rasa))) == data)
+            self.assertTrue(list(NlpData.stream(io.StringIO(json.dumps(data)))) == data)
+            self.assertTrue(list(NlpData.stream(io.StringIO('[]'))) == [])
+        finally:
+            NlpData.chunk_size = chunk_size
+
     # ======= #
     # SIGNALS #
     # ======= #
@@ -159,6 +420,21 @@ class botiumUnitTest(unittest.TestCase):
         message = Message(text=self.TEXT)
         self.assertTrue(dict(message) == dict(text=self.TEXT))
 
+    def test_message_features(self):
+        message = Message(text=' My NAME is   Bob! ')
+        features = message.features
+        self.assertTrue(features.lower == ' my name is   bob! ')
+        self.assertTrue(features.clean == 'my name is bob!')
+        self.assertTrue(features.tokens == ['my', 'name', 'is', 'bob!'])
+        self.assertTrue(features.hash == 'mynameisbob')
+        self.assertTrue(features.ngrams(3)[:3] == [' my', 'my ', 'y n'])
+        # computed once, not serialized
+        self.assertTrue(message.features is features)
+        self.assertTrue(dict(message) == dict(text=' My NAME is   Bob! '))
+        # recomputed when text changes
+        message['text'] = 'stop'
+        self.assertTrue(message.features.lower == 'stop')
+
     def test_matcher(self):
         # saving restoring
         # matcher = Matcher(options=['a', int, str, re.compile('(hi)[i]+'), NamedEntity(name='age')])
@@ -251,6 +527,70 @@ class botiumUnitTest(unittest.TestCase):
         self.assertTrue(Matcher(options=NamedEntity(name='location'))(message) == \
                         Response(confidence=1, match=None, message=message))
 
+    def test_matcher_multi_pattern(self):
+        # automaton
+        self.assertTrue(list(AhoCorasick(['he', 'she', 'hers']).finditer('ushers')) == [(1, 4, 1), (2, 4, 0),
+                                                                                         (2, 6, 2)])
+
+        # first matching regex wins, as with one by one search
+        patterns = [re.compile(r'(\d+) years'), re.compile(r'(?P<name>bob|alice)'), re.compile('(b)')]
+        for text in ['bob is 5 years old', 'alice', 'abc', 'nothing']:
+            i, m = MultiPattern(patterns).search(text)
+            expected = next(((i, p.search(text)) for i, p in enumerate(patterns) if p.search(text)), (None, None))
+            self.assertTrue(i == expected[0])
+            self.assertTrue(m is None or m.span() == expected[1].span())
+
+        # big keyword sets go to the automaton
+        keywords = ['word%d' % i for i in range(MultiPattern.automaton_min_size)] + ['yes', 'yeah']
+        patterns = [re.compile('(%s)' % k, re.IGNORECASE) for k in keywords]
+        self.assertTrue(MultiPattern(patterns)._automaton is not None)
+        self.assertTrue(Matcher(options=patterns)(Message(text='oh YEAH')) ==
+                        Response(confidence=1, match='YEAH', message=Message(text='oh YEAH')))
+
+        # entities are the same as with a single regex
+        options = {'name': [re.compile(r'my (name) is (?P<name>\w+)'), re.compile(r'i am (?P<name>\w+)')],
+                   'age': [re.compile(r'(\d+) years')]}
+        r = Matcher(options=options)(Message(text='i am bob'))
+        self.assertTrue(r.match == 'name' and r.entities == {'name': 'i am bob'})
+        r = Matcher(options=list(options['name']))(Message(text='my name is bob'))
+        self.assertTrue(r.match == 'name' and r.entities == {'name': 'bob'})
+
+        # a match with an empty group is no match, the next pattern is tried
+        patterns = [re.compile(r'(a)?b'), re.compile(r'(c)')]
+        self.assertTrue(Matcher(options=patterns)(Message(text='bc')).match == 'c')
+        self.assertTrue(Matcher(options={'x': patterns})(Message(text='bc')).match == 'x')
+        self.assertTrue(Matcher(options=patterns)(Message(text='ab')).match == 'a')
+
+    def test_matcher_cache(self):
+        Matcher.cache_clear()
+        options = {'yes': ['yes', 'yeah'], 'no': ['no', 'nope']}
+        r1 = Matcher(options=options)(Message(text='yeah'))
+        r2 = Matcher(options=dict(options))(Message(text='yeah'))
+        self.assertTrue(r1 == r2 and r1 is not r2)
+        self.assertTrue(Matcher.cache_info()['hits'] == 1 and Matcher.cache_info()['misses'] == 1)
+
+        # cached entities are not shared
+        r2.entities['yes'] = 'changed'
+        self.assertTrue(Matcher(options=options)(Message(text='yeah')).entities == {'yes': 'yeah'})
+
+        # options of different types are different keys
+        self.assertTrue(Matcher(options=[1])(Message(text='1')).confidence == 1)
+        self.assertTrue(Matcher(options=[True])(Message(text='1')).confidence is False)
+
+        # callables are not cached
+        info = Matcher.cache_info()
+        Matcher(options=lambda x: 1)(Message(text='yeah'))
+        self.assertTrue(Matcher.cache_info()['size'] == info['size'])
+
+        size = config.MATCH_CACHE_SIZE
+        config.MATCH_CACHE_SIZE = 1
+        try:
+            Matcher(options=['a'])(Message(text='a'))
+            Matcher(options=['b'])(Message(text='b'))
+            self.assertTrue(Matcher.cache_info()['size'] == 1)
+        finally:
+            config.MATCH_CACHE_SIZE = size
+
     # ---------- #
     # CONDITIONS #
     # ---------- #
@@ -617,6 +957,168 @@ class botiumUnitTest(unittest.TestCase):
         bot.reply(text='yes')
         self.assertTrue(is_empty(bot.state))
 
+    def test_attention_pruning(self):
+        scored = []
+
+        class Slow(Intent):
+            _max_score = 0.5
+
+            def score(self, message, **kwargs):
+                scored.append(self._name)
+                return 0.5
+
+            def __call__(self, *args, **kwargs):
+                return Say(text='slow')
+
+        class Unbounded(Slow):
+            _max_score = None
+
+        config.CONFIRM_STOP = False
+        # Stop can't be beaten by Slow, but Unbounded has to be scored
+        bot = Bot(intents=[Slow, Unbounded, Stop])
+        bot.reply(text='stop')
+        self.assertTrue(scored == ['Unbounded'])
+
+        # with focus, intents are not scored at all
+        scored.clear()
+        bot.do(actions=Ask(text='how are you?', options=['good', 'bad']))
+        bot.reply(text='good')
+        self.assertTrue(scored == [] and is_empty(bot.state, but={'Memory'}))
+
+        # selected intent is the same: first of the best ones
+        bot = Bot(intents=[Unbounded, Slow, Echo])
+        bot.reply(text='hi')
+        self.assertTrue(scored == ['Unbounded'] and bot.mouth[-1].text == 'Slow.')
+        config.CONFIRM_STOP = True
+
+        # a new score doesn't inherit the bound
+        class Loud(Echo):
+            def score(self, message, **kwargs):
+                return 1
+
+            def __call__(self, *args, **kwargs):
+                return Say(text='loud')
+
+        self.assertTrue(Loud._max_score is None and Echo._max_score == 0.01)
+        bot = Bot(intents=[Slow, Loud])
+        bot.reply(text='hi')
+        self.assertTrue(bot.mouth[-1].text == 'Loud.')
+
+    def test_attention_keywords(self):
+        scored = []
+
+        def keyword_intent(name, keywords):
+            def score(self, message, **kwargs):
+                scored.append(self._name)
+                return any(k in message.text.lower() for k in keywords)
+
+            return type(name, (Intent,), dict(_keywords=keywords, score=score,
+                                              __call__=lambda self, *args, **kwargs: Say(text=name)))
+
+        intents = [keyword_intent('Intent%d' % i, ['word%d' % i]) for i in range(50)]
+        intents.append(keyword_intent('Phrase', ['good morning']))
+
+        bot = Bot(intents=intents)
+        bot.reply(text='so, Word7!')
+        self.assertTrue(scored == ['Intent7'] and bot.mouth[-1].text == 'Intent7.')
+
+        scored.clear()
+        bot.reply(text='good morning')
+        self.assertTrue(scored == ['Phrase'] and bot.mouth[-1].text == 'Phrase.')
+
+        # nothing is scored: the first intent wins (as before)
+        scored.clear()
+        bot.reply(text='morning good')
+        self.assertTrue(scored == [] and bot.mouth[-1].text == 'Intent0.')
+
+        index = KeywordIndex.of(tuple(intents))
+        self.assertTrue(index.candidates(['good', 'morning', 'word3']) == {3, 50})
+
+        # a new score doesn't inherit the keywords
+        class Always(Stop):
+            def score(self, message, **kwargs):
+                return 1
+
+            def __call__(self, *args, **kwargs):
+                return Say(text='always')
+
+        self.assertTrue(Always._keywords is None and Stop._keywords == ['stop'])
+        bot = Bot(intents=[Always])
+        bot.reply(text='hi')
+        self.assertTrue(bot.mouth[-1].text == 'Always.')
+
+    def test_attention_lazy_nlp(self):
+        nlp = TestNlp()
+        bot = Bot(nlp=nlp)
+
+        # plain options: entities are not needed
+        bot.do(actions=Ask(text='ready?', options=['yes', 'no']))
+        bot.reply(text='yes')
+        self.assertTrue(nlp.calls_info() == dict(attached=1, called=0, avoided=1))
+
+        bot.do(actions=Ask(text='where are you from?', options=NamedEntity(name='location')))
+        bot.reply(text='from riga')
+        self.assertTrue(nlp.calls_info() == dict(attached=2, called=1, avoided=1))
+        self.assertTrue(bot.memory['general'].popitem()[1]['match'] == 'riga')
+
+        # any callable works as an engine (its intents are unknown until it runs)
+        message = Message(text='hi')
+        message.attach_nlp(lambda text: dict(entities=[], intents=[dict(intent='echo', confidence=0.5)]))
+        self.assertTrue(message.intent_confidence('Echo') == 0.5 and message.intent_confidence('Stop') == 0)
+
+    def test_attention_executor(self):
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        class Slow(Intent):
+            def score(self, message, **kwargs):
+                sleep(0.2)
+                return 1
+
+            def __call__(self, *args, **kwargs):
+                return Say(text='slow')
+
+        class Fast(Slow):
+            def score(self, message, **kwargs):
+                return 0.5
+
+            def __call__(self, *args, **kwargs):
+                return Say(text='fast')
+
+        with ThreadPoolExecutor(4) as executor:
+            bot = Bot(intents=[Slow, Fast, Echo], executor=executor)
+            bot.reply(text='hi')
+            self.assertTrue(bot.mouth[-1].text == 'Slow.')
+
+            # slow intent times out and scores 0
+            timeout = config.SCORE_TIMEOUT
+            config.SCORE_TIMEOUT = 0.05
+            try:
+                bot.reply(text='hi')
+                self.assertTrue(bot.mouth[-1].text == 'Fast.')
+            finally:
+                config.SCORE_TIMEOUT = timeout
+
+        # picklable intents in processes
+        with ProcessPoolExecutor(2) as executor:
+            bot = Bot(intents=[Echo, FirstMessage, Grapher], executor=executor)
+            bot.reply(text='hi')
+            self.assertTrue(bot.mouth[-1].text == 'ECHO: hi.')
+
+            # NLP engine (with its locks) stays in this process, entities are sent along
+            nlp = TestNlp()
+            nlp('warm up')
+            bot = Bot(intents=[Echo, NameIntent], executor=executor, nlp=nlp)
+            bot.reply(text='my name is bob')
+            self.assertTrue(bot.mouth[-1].text == 'Named.')
+            bot.reply(text='hi')
+            self.assertTrue(bot.mouth[-1].text == 'ECHO: hi.')
+
+        message = Message(text='my name is bob')
+        message.attach_nlp(nlp)
+        self.assertTrue(pickle.loads(pickle.dumps(message)).has_nlp() is False)
+        message._run_nlp()
+        self.assertTrue(pickle.loads(pickle.dumps(message))._entities == message._entities)
+
     def test_basic_intent_restart(self):
         config.CONFIRM_RESTART = False
         bot = TestBot()
@@ -756,6 +1258,43 @@ class botiumUnitTest(unittest.TestCase):
         self.assertTrue(r[0]._is(Trigger))
         self.assertTrue(area.is_empty())
 
+        # INDEX: only triggers depending on the event are checked
+        area = Triggers()
+        conditions = [EventCondition(event=Event(signal=Message)),
+                      EventCondition(event=Event(signal=Say, type='done')),
+                      TextCondition(event=Event(signal=Signal), options=['yo']),
+                      TimeCondition(time=current_time() + 10000)]
+        for condition in conditions:
+            area(SetTrigger(trigger=Trigger(condition=condition, actions=Say(text='hi'))))
+        relevant = lambda event: [conditions.index(trigger.condition) for trigger in area.relevant(event)]
+        self.assertTrue(relevant(Event(signal=Message(text='yo'))) == [0, 2, 3])
+        self.assertTrue(relevant(Event(signal=Say(text='yo'))) == [2, 3])
+        self.assertTrue(relevant(Event(signal=Say(text='yo'), type='done')) == [1, 2, 3])
+        # index follows the changes
+        area.pop()
+        self.assertTrue(relevant(Event(signal=Message(text='yo'))) == [2, 3])
+        # a new __call__ doesn't keep the dependencies of the parent
+        class AnyText(TextCondition):
+            def __call__(self, event, _areas=None, **kwargs):
+                return bool(event.signal.text)
+
+        condition = AnyText(event=Event(signal=Message), options=['yo'])
+        area(SetTrigger(trigger=Trigger(condition=condition, actions=Say(text='hi'))))
+        self.assertTrue(condition.depends_on() is None and condition(Event(signal=Say(text='yo'))))
+        self.assertTrue(condition in [trigger.condition for trigger in area.relevant(Event(signal=Say(text='yo')))])
+
+        # COUNTS: conditions are marked met by Events area
+        bot = Bot()
+        condition = CountCondition(event=Event(signal=Message), n=2)
+        bot.do(actions=SetTrigger(trigger=Trigger(condition=condition, actions=Say(text='two'))))
+        triggers, events = bot._areas['Triggers'], bot._areas['Events']
+        self.assertTrue(triggers.relevant(Event(signal=Say(text='yo'))) == [])
+        self.assertTrue(condition._met is False and list(events._watchers) == [condition.count_key()])
+        bot.reply(text='one')
+        self.assertTrue(condition._met is False and bot.mouth.is_empty())
+        bot.reply(text='two')
+        self.assertTrue(bot.mouth[0].text == 'Two.' and triggers.is_empty())
+
     # ====================== #
     # MEMORY AND STACK STATE #
     # ====================== #
@@ -864,5 +1403,50 @@ class botiumUnitTest(unittest.TestCase):
 
         self.assertTrue(s == [1, 2, 3, 4])
 
+    def test_dispatcher(self):
+        done = []
+        active = {}
+        lock = threading.Lock()
+
+        def task(user, i):
+            with lock:
+                # one task per user at a time
+                self.assertFalse(active.get(user))
+                active[user] = True
+            sleep(0.001)
+            with lock:
+                active[user] = False
+                done.append((user, i))
+            return i
+
+        with Dispatcher(workers=4) as dispatcher:
+            futures = [dispatcher.submit(user, task, user, i) for i in range(20) for user in 'abc']
+            self.assertTrue(dispatcher.join(5))
+            self.assertTrue([f.result() for f in futures] == [i for i in range(20) for _ in 'abc'])
+            # in order per user
+            for user in 'abc':
+                self.assertTrue([i for u, i in done if u == user] == list(range(20)))
+            stats = dispatcher.stats()
+            self.assertTrue(stats['processed'] == 60 and stats['pending'] == 0 and stats['sessions'] == 0)
+
+            # errors are passed to the future
+            self.assertRaises(ZeroDivisionError, dispatcher.submit('a', lambda: 1 / 0).result, 5)
+            self.assertTrue(dispatcher.stats()['failed'] == 1)
+
+        # backpressure
+        event = threading.Event()
+        with Dispatcher(workers=1, max_pending=2) as dispatcher:
+            dispatcher.submit('a', event.wait)
+            # the worker took the first task
+            self.assertTrue(dispatcher.join(0.5) is False)
+            dispatcher.submit('b', len, 'b')
+            dispatcher.submit('c', len, 'c')
+            self.assertTrue(dispatcher.stats()['pending'] == 2)
+            self.assertRaises(queue.Full, dispatcher.submit, 'd', len, 'd', block=False)
+            self.assertRaises(queue.Full, dispatcher.submit, 'd', len, 'd', timeout=0.01)
+            self.assertTrue(dispatcher.stats()['rejected'] == 2)
+            event.set()
+        self.assertRaises(RuntimeError, dispatcher.submit, 'a', len, 'a')
+
 
 self = botiumUnitTest()